@@ -0,0 +1,66 @@
+"""Add GIN jsonb_path_ops indexes on visits.vital_signs and visits.lab_results
+
+Revision ID: a3f1c9e2b7d4
+Revises: 9b4759f2a941
+Create Date: 2026-10-15 09:12:04.318275
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9e2b7d4'
+down_revision: Union[str, None] = '9b4759f2a941'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+JSON_COLUMNS = ('vital_signs', 'lab_results')
+
+
+def upgrade() -> None:
+    """
+    Upgrade: Store visit JSON columns as JSONB and index them with GIN.
+
+    PostgreSQL only. The plain JSON type cannot carry a GIN index, so the
+    columns are converted to JSONB first. jsonb_path_ops serves the @>
+    containment operator at roughly half the size of the default jsonb_ops.
+    MySQL has no GIN equivalent, so this revision is a no-op there.
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for column in JSON_COLUMNS:
+        op.alter_column('visits', column,
+                        existing_type=sa.JSON(),
+                        type_=postgresql.JSONB(),
+                        postgresql_using=f'{column}::jsonb')
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for column in JSON_COLUMNS:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_visits_{column}_gin "
+                f"ON visits USING GIN ({column} jsonb_path_ops)"
+            )
+
+
+def downgrade() -> None:
+    """
+    Downgrade: Drop the GIN indexes and revert the columns to JSON.
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    with op.get_context().autocommit_block():
+        for column in JSON_COLUMNS:
+            op.execute(
+                f"DROP INDEX CONCURRENTLY IF EXISTS ix_visits_{column}_gin")
+
+    for column in JSON_COLUMNS:
+        op.alter_column('visits', column,
+                        existing_type=postgresql.JSONB(),
+                        type_=sa.JSON(),
+                        postgresql_using=f'{column}::json')
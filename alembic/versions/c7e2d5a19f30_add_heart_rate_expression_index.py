@@ -0,0 +1,56 @@
+"""Add expression index on visits heart rate
+
+Revision ID: c7e2d5a19f30
+Revises: a3f1c9e2b7d4
+Create Date: 2026-10-15 10:03:41.552019
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2d5a19f30'
+down_revision: Union[str, None] = 'a3f1c9e2b7d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    Upgrade: Index the numeric heart rate extracted from vital_signs.
+
+    The indexed expression matches the one the analytics prompt teaches the
+    AI to emit, so AVG/MIN/MAX over heart rate avoid a per-row JSON parse.
+    """
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        # CONCURRENTLY keeps visits writable during the build; it cannot
+        # run inside a transaction block
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_visits_heart_rate "
+                "ON visits (((vital_signs->>'heart_rate')::numeric)) "
+                "WHERE vital_signs ? 'heart_rate'"
+            )
+    elif dialect == 'mysql':
+        # Functional key parts need MySQL 8.0.13+
+        op.execute(
+            "CREATE INDEX ix_visits_heart_rate "
+            "ON visits ((CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2))))"
+        )
+
+
+def downgrade() -> None:
+    """
+    Downgrade: Drop the heart rate expression index.
+    """
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_visits_heart_rate")
+    elif dialect == 'mysql':
+        op.drop_index('ix_visits_heart_rate', table_name='visits')
@@ -0,0 +1,65 @@
+"""Add indexes on visits visit_date, visit_type and patient_id
+
+Revision ID: e4b8a61d2c57
+Revises: c7e2d5a19f30
+Create Date: 2026-10-15 14:27:09.846113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8a61d2c57'
+down_revision: Union[str, None] = 'c7e2d5a19f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXED_COLUMNS = ('visit_date', 'visit_type', 'patient_id')
+
+
+def upgrade() -> None:
+    """
+    Upgrade: Index the visit columns analytics and listings filter on.
+
+    visit_date serves the "last N days" range scans and ORDER BY visit_date,
+    visit_type the equality filters, and patient_id the joins and GROUP BY
+    patient. PostgreSQL does not index foreign keys on its own. On MySQL,
+    InnoDB drops its implicit foreign key index once ix_visits_patient_id
+    exists, so every dialect ends up matching the model.
+    """
+    if op.get_bind().dialect.name == 'postgresql':
+        # Built CONCURRENTLY so visits stays writable during the build;
+        # that cannot run inside a transaction block
+        with op.get_context().autocommit_block():
+            for column in INDEXED_COLUMNS:
+                op.create_index(op.f(f'ix_visits_{column}'), 'visits', [column],
+                                unique=False, postgresql_concurrently=True,
+                                if_not_exists=True)
+        return
+
+    for column in INDEXED_COLUMNS:
+        op.create_index(op.f(f'ix_visits_{column}'), 'visits', [column], unique=False)
+
+
+def downgrade() -> None:
+    """
+    Downgrade: Drop the visit filter indexes.
+    """
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            for column in reversed(INDEXED_COLUMNS):
+                op.drop_index(op.f(f'ix_visits_{column}'), table_name='visits',
+                              postgresql_concurrently=True, if_exists=True)
+        return
+
+    for column in reversed(INDEXED_COLUMNS):
+        if dialect == 'mysql' and column == 'patient_id':
+            # The foreign key still needs an index, so MySQL refuses the drop;
+            # hand ours back under the name InnoDB gives its implicit one
+            op.execute("ALTER TABLE visits RENAME INDEX ix_visits_patient_id TO patient_id")
+            continue
+        op.drop_index(op.f(f'ix_visits_{column}'), table_name='visits')
@@ -1,15 +1,114 @@
 from typing import Dict, Any, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
+from sqlalchemy import text, TextClause
+from sqlglot import exp
 from app.agents.base_agent import FallbackAgent
 from app.agents.query_cache import QueryCache
+from app.agents.sqlite_cache import SQLiteQueryStore
 from app.agents.query_templates import QueryTemplates
-import json
+from app.config import settings
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+import orjson
+import sqlglot
+import asyncio
+import hashlib
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Generated SQL must match the dialect of the configured database
+_IS_POSTGRES = settings.DATABASE_URL.startswith("postgresql")
+_IS_MYSQL = settings.DATABASE_URL.startswith("mysql")
+_IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
+# Per-query execution ceiling for analytics SQL
+_STATEMENT_TIMEOUT_MS = 10_000
+
+if _IS_POSTGRES:
+    # vital_signs / lab_results are JSONB with GIN (jsonb_path_ops) indexes,
+    # which only serve the @> containment and ? key-exists operators;
+    # ix_visits_heart_rate indexes (vital_signs->>'heart_rate')::numeric
+    _JSON_RULE = (
+        "For JSON fields (vital_signs, lab_results), filter with the containment "
+        "operator @> (e.g. vital_signs @> '{\"heart_rate\": 80}') or the key-exists "
+        "operator ? (e.g. vital_signs ? 'heart_rate') so the GIN index is used. "
+        "Read values with ->> and cast them (e.g. (vital_signs->>'heart_rate')::numeric). "
+        "Never use JSON_EXTRACT"
+    )
+    _JSON_EXAMPLES = """Question: "What's the average heart rate?"
+SQL: SELECT AVG((vital_signs->>'heart_rate')::numeric) as avg_heart_rate FROM visits WHERE vital_signs ? 'heart_rate';
+
+Question: "How many visits recorded a heart rate of 80?"
+SQL: SELECT COUNT(*) as visit_count FROM visits WHERE vital_signs @> '{"heart_rate": 80}';"""
+else:
+    # ix_visits_heart_rate indexes CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2))
+    _JSON_RULE = (
+        "For JSON fields (vital_signs, lab_results), use the ->> operator "
+        "(e.g. CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2)))"
+    )
+    _JSON_EXAMPLES = """Question: "What's the average heart rate?"
+SQL: SELECT AVG(CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2))) as avg_heart_rate FROM visits WHERE vital_signs IS NOT NULL;"""
+
+_JSON_TYPE = "JSONB" if _IS_POSTGRES else "JSON"
+
+_SCHEMA_INFO = f"""
+TABLES:
+
+1. patients (id, patient_id, first_name, last_name, date_of_birth, gender, 
+             phone, email, medical_history, allergies, current_medications)
+
+2. visits (id, visit_id, patient_id, visit_date, visit_type, chief_complaint,
+          symptoms, diagnosis, treatment_plan, medications_prescribed, 
+          doctor_notes, vital_signs {_JSON_TYPE}, lab_results {_JSON_TYPE}, duration_minutes)
+
+3. users (id, username, email, role, is_active)
+"""
+
+_SQL_FENCE_RE = re.compile(r'```sql\n?|```\n?')
+_SQL_PREFIX_RE = re.compile(r'^(SQL:|Query:)\s*', re.IGNORECASE | re.MULTILINE)
+_SELECT_RE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+# sqlglot dialect used to parse analytics SQL
+_SQL_DIALECT = ("postgres" if _IS_POSTGRES else "mysql" if _IS_MYSQL
+                else "sqlite" if _IS_SQLITE else None)
+
+# Nodes that make a statement more than a read, anywhere in the tree
+_WRITE_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Alter, exp.Create,
+    exp.Merge, exp.Into, exp.Command
+)
+
+# Rule #5 of the SQL prompt, enforced on AI output rather than trusted
+_DEFAULT_LIMIT = 100
+
+
+@lru_cache(maxsize=512)
+def _text_clause(sql: str) -> TextClause:
+    """Reuse the TextClause for repeated SQL (cache/template hits are identical strings)"""
+    return text(sql)
+
+
+@lru_cache(maxsize=512)
+def _parse_read_only(sql: str) -> Optional[exp.Query]:
+    """Parse SQL into a single read-only query tree, or None if it isn't one"""
+    try:
+        statements = sqlglot.parse(sql, read=_SQL_DIALECT)
+    except sqlglot.errors.ParseError:
+        return None
+
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return None
+
+    tree = statements[0]
+    if any(isinstance(node, _WRITE_NODES) for node in tree.walk()):
+        return None
+
+    return tree
+
+
 class AnalyticsAgent:
     """
     Hybrid AI agent for analytics queries.
@@ -18,8 +117,13 @@ class AnalyticsAgent:
     
     def __init__(self):
         # Initialize hybrid components
-        self.cache = QueryCache(ttl_hours=24)
+        store = (SQLiteQueryStore(settings.QUERY_CACHE_DB_PATH)
+                 if settings.QUERY_CACHE_DB_PATH else None)
+        # SQL read back from the on-disk store is re-checked before use
+        self.cache = QueryCache(ttl_hours=24, store=store, validate=self._is_safe_query)
         self.templates = QueryTemplates()
+        # Templates are trusted per request, so check them once here
+        self._validate_templates()
         
         # Database schema for AI context
         self.schema_info = self._get_schema_info()
@@ -34,7 +138,7 @@ DATABASE SCHEMA:
 RULES:
 1. ONLY generate SELECT queries (no INSERT, UPDATE, DELETE, DROP, ALTER)
 2. Use proper JOIN syntax when querying multiple tables
-3. For JSON fields (vital_signs, lab_results), use JSON_EXTRACT or -> operator
+3. {_JSON_RULE}
 4. Always use table aliases for clarity
 5. Include LIMIT clause for large result sets (default 100)
 6. Use proper date functions for time-based queries
@@ -44,8 +148,7 @@ EXAMPLES:
 Question: "How many visits in the last 30 days?"
 SQL: SELECT COUNT(*) as visit_count FROM visits WHERE visit_date >= DATE_SUB(NOW(), INTERVAL 30 DAY);
 
-Question: "What's the average heart rate?"
-SQL: SELECT AVG(JSON_EXTRACT(vital_signs, '$.heart_rate')) as avg_heart_rate FROM visits WHERE vital_signs IS NOT NULL;
+{_JSON_EXAMPLES}
 
 Question: "Which patient has the most visits?"
 SQL: SELECT p.first_name, p.last_name, COUNT(v.id) as visit_count FROM patients p JOIN visits v ON p.id = v.patient_id GROUP BY p.id ORDER BY visit_count DESC LIMIT 1;
@@ -75,18 +178,7 @@ Keep it brief (2-3 sentences).
     
     def _get_schema_info(self) -> str:
         """Get database schema information"""
-        return """
-TABLES:
-
-1. patients (id, patient_id, first_name, last_name, date_of_birth, gender, 
-             phone, email, medical_history, allergies, current_medications)
-
-2. visits (id, visit_id, patient_id, visit_date, visit_type, chief_complaint,
-          symptoms, diagnosis, treatment_plan, medications_prescribed, 
-          doctor_notes, vital_signs JSON, lab_results JSON, duration_minutes)
-
-3. users (id, username, email, role, is_active)
-"""
+        return _SCHEMA_INFO
     
     async def answer_analytics_question(
         self,
@@ -105,7 +197,7 @@ TABLES:
         
         try:
             # Step 1: Check cache (FREE, instant)
-            sql_query = self.cache.get(question)
+            sql_query = await self.cache.get(question)
             if sql_query:
                 sql_source = "cache"
                 self.stats['cache_hits'] += 1
@@ -119,7 +211,7 @@ TABLES:
                     self.stats['template_matches'] += 1
                     logger.info(f"✅ Template MATCH for: {question[:50]}...")
                     # Cache for future use
-                    self.cache.set(question, sql_query)
+                    await self.cache.set(question, sql_query)
             
             # Step 3: Use AI (costs ~$0.0006)
             if not sql_query:
@@ -127,31 +219,56 @@ TABLES:
                 sql_source = "ai"
                 self.stats['ai_generations'] += 1
                 logger.info(f"🤖 AI GENERATION for: {question[:50]}...")
+                
+                # Only AI output needs validating here: templates are checked
+                # at startup, and the cache validates SQL it loads from disk
+                if not self._is_safe_query(sql_query):
+                    return {
+                        "error": "Generated query is not safe (contains write operations)",
+                        "query": sql_query,
+                        "source": sql_source
+                    }
+                
+                sql_query = self._enforce_limit(sql_query)
                 # Cache for future use
-                self.cache.set(question, sql_query)
-            
-            # Validate SQL for safety
-            if not self._is_safe_query(sql_query):
-                return {
-                    "error": "Generated query is not safe (contains write operations)",
-                    "query": sql_query,
-                    "source": sql_source
-                }
+                await self.cache.set(question, sql_query)
             
             # Execute query
             results = await self._execute_query(sql_query, db)
+            # Rows are fully fetched; end the read-only transaction so the
+            # connection goes back to the pool rather than being pinned
+            # through the LLM round-trip. Rolled back, never committed, so
+            # nothing the generated SQL did can persist.
+            await db.rollback()
+            
+            # Generate explanation (optional). The LLM call is the long pole,
+            # so reuse the cached one while the data is unchanged, otherwise
+            # start it on the first rows before formatting the rest.
+            explanation = None
+            explain_task = None
+            if explain and results:
+                head = self._format_results(results[:5])
+                result_sig = self._result_signature(head, len(results))
+                explanation = self.cache.get_explanation(question, result_sig)
+                if explanation is None:
+                    explain_task = asyncio.create_task(self._explain_results(
+                        question,
+                        sql_query,
+                        head,
+                        total_rows=len(results)
+                    ))
             
             # Format results
-            formatted_results = self._format_results(results)
+            try:
+                formatted_results = await asyncio.to_thread(self._format_results, results)
+            except Exception:
+                if explain_task:
+                    explain_task.cancel()
+                raise
             
-            # Generate explanation (optional)
-            explanation = None
-            if explain and formatted_results:
-                explanation = await self._explain_results(
-                    question, 
-                    sql_query, 
-                    formatted_results
-                )
+            if explain_task:
+                explanation = await explain_task
+                self.cache.set_explanation(question, result_sig, explanation)
             
             return {
                 "question": question,
@@ -187,7 +304,7 @@ TABLES:
         
         try:
             # Steps 1-3: Get SQL query (same as non-streaming)
-            sql_query = self.cache.get(question)
+            sql_query = await self.cache.get(question)
             if sql_query:
                 sql_source = "cache"
                 self.stats['cache_hits'] += 1
@@ -197,23 +314,28 @@ TABLES:
                 if sql_query:
                     sql_source = "template"
                     self.stats['template_matches'] += 1
-                    self.cache.set(question, sql_query)
+                    await self.cache.set(question, sql_query)
             
             if not sql_query:
                 sql_query = await self._generate_sql_with_ai(question)
                 sql_source = "ai"
                 self.stats['ai_generations'] += 1
-                self.cache.set(question, sql_query)
-            
-            # Validate & execute
-            if not self._is_safe_query(sql_query):
-                yield json.dumps({
-                    "type": "error",
-                    "error": "Generated query is not safe"
-                })
-                return
+                
+                # Validate AI output before it can reach the cache
+                if not self._is_safe_query(sql_query):
+                    yield orjson.dumps({
+                        "type": "error",
+                        "error": "Generated query is not safe"
+                    }).decode()
+                    return
+                
+                sql_query = self._enforce_limit(sql_query)
+                await self.cache.set(question, sql_query)
             
+            # Execute
             results = await self._execute_query(sql_query, db)
+            # Release the connection before streaming; see answer_analytics_question
+            await db.rollback()
             formatted_results = self._format_results(results)
             
             # Yield metadata first (non-streamed, sent as one chunk)
@@ -225,30 +347,33 @@ TABLES:
                 "row_count": len(formatted_results) if formatted_results else 0,
                 "source": sql_source
             }
-            yield json.dumps(metadata)
+            yield orjson.dumps(metadata, default=str).decode()
             
             # Stream explanation if we have results
             if formatted_results:
-                explanation_prompt = f"""
-Given this analytics question and results, provide a concise summary.
-
-Question: {question}
-Results: {json.dumps(formatted_results[:5])}
-Total Rows: {len(formatted_results)}
-
-Provide a 2-3 sentence summary.
-"""
+                head = formatted_results[:5]
+                result_sig = self._result_signature(head, len(formatted_results))
+                explanation = self.cache.get_explanation(question, result_sig)
+                if explanation is not None:
+                    yield explanation
+                    return
+                
+                explanation_prompt = self._explanation_prompt(
+                    question, head, len(formatted_results))
                 
-                # Stream the explanation
+                # Stream the explanation, keeping it for the cache
+                chunks = []
                 async for chunk in self.explainer_agent.run_stream(explanation_prompt):
+                    chunks.append(chunk)
                     yield chunk
+                self.cache.set_explanation(question, result_sig, ''.join(chunks).strip())
             
         except Exception as e:
             logger.error(f"Error in streaming analytics: {e}")
-            yield json.dumps({
+            yield orjson.dumps({
                 "type": "error",
                 "error": str(e)
-            })
+            }).decode()
     
     async def _generate_sql_with_ai(self, question: str) -> str:
         """Generate SQL using AI (fallback option)"""
@@ -260,11 +385,10 @@ Provide a 2-3 sentence summary.
     def _extract_sql(self, response: str) -> str:
         """Extract clean SQL from AI response"""
         # Remove markdown code blocks
-        response = re.sub(r'```sql\n?', '', response)
-        response = re.sub(r'```\n?', '', response)
+        response = _SQL_FENCE_RE.sub('', response)
         
         # Remove common prefixes
-        response = re.sub(r'^(SQL:|Query:)\s*', '', response, flags=re.IGNORECASE | re.MULTILINE)
+        response = _SQL_PREFIX_RE.sub('', response)
         
         # Clean up the response
         response = response.strip()
@@ -282,20 +406,43 @@ Provide a 2-3 sentence summary.
         
         return sql.strip()
     
+    @staticmethod
+    def _is_read_only(sql: str) -> bool:
+        """Check SQL parses to a single query with no write operations"""
+        # Parsed rather than keyword-matched, so LIKE '%CREATE%' or a
+        # created_at column is fine and "; DROP ..." payloads are not
+        return _parse_read_only(sql) is not None
+    
+    @staticmethod
+    def _enforce_limit(sql: str) -> str:
+        """
+        Add LIMIT to a query that has none.
+
+        The clause is appended to the original text rather than re-rendering
+        the parsed tree, which can rewrite dialect-specific syntax (e.g. ->>)
+        into functions the database lacks. It goes on its own line so a
+        trailing -- comment can't swallow it.
+        """
+        tree = _parse_read_only(sql)
+        if tree is None or tree.args.get('limit') is not None:
+            return sql
+        return f"{sql.strip().rstrip(';').rstrip()}\nLIMIT {_DEFAULT_LIMIT}"
+    
+    def _validate_templates(self) -> None:
+        """Fail fast at startup if any template isn't read-only"""
+        for name, template in self.templates.templates.items():
+            # Fill placeholders (days, field) so the SQL parses
+            sql = template['sql'].format(**{param: param for param in template['params']})
+            if not self._is_read_only(sql):
+                raise ValueError(f"Query template '{name}' is not a read-only SELECT")
+    
     def _is_safe_query(self, sql: str) -> bool:
         """Validate SQL is read-only"""
-        sql_upper = sql.upper()
-        
-        forbidden = [
-            'INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER',
-            'CREATE', 'TRUNCATE', 'REPLACE', 'GRANT', 'REVOKE'
-        ]
-        
-        for operation in forbidden:
-            if operation in sql_upper:
-                return False
-        
-        if not sql_upper.strip().startswith('SELECT'):
+        if not self._is_read_only(sql):
+            return False
+
+        # JSON_EXTRACT is MySQL-only; PostgreSQL must use ->, ->>, @> or ?
+        if _IS_POSTGRES and 'JSON_EXTRACT' in sql.upper():
             return False
         
         return True
@@ -306,14 +453,16 @@ Provide a 2-3 sentence summary.
         db: AsyncSession
     ) -> List[Dict[str, Any]]:
         """Execute SQL query"""
-        result = await db.execute(text(sql))
-        rows = result.fetchall()
-        
-        if not rows:
-            return []
-        
-        columns = result.keys()
-        return [dict(zip(columns, row)) for row in rows]
+        # Bound AI-generated SQL so a runaway query can't pin a connection
+        if _IS_POSTGRES:
+            await db.execute(_text_clause(f"SET LOCAL statement_timeout = {_STATEMENT_TIMEOUT_MS}"))
+        elif _IS_MYSQL:
+            sql = _SELECT_RE.sub(
+                f"SELECT /*+ MAX_EXECUTION_TIME({_STATEMENT_TIMEOUT_MS}) */", sql, count=1)
+
+        # RowMappings are already dict-like, no per-row dict(zip(...)) copy
+        result = await db.execute(_text_clause(sql))
+        return result.mappings().all()
     
     def _format_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Format results for JSON serialization"""
@@ -324,9 +473,9 @@ Provide a 2-3 sentence summary.
         for row in results:
             formatted_row = {}
             for key, value in row.items():
-                if hasattr(value, 'isoformat'):
+                if isinstance(value, (datetime, date)):
                     formatted_row[key] = value.isoformat()
-                elif hasattr(value, '__float__'):
+                elif isinstance(value, Decimal):
                     formatted_row[key] = float(value)
                 else:
                     formatted_row[key] = value
@@ -334,22 +483,42 @@ Provide a 2-3 sentence summary.
         
         return formatted
     
-    async def _explain_results(
-        self,
+    @staticmethod
+    def _explanation_prompt(
         question: str,
-        sql: str,
-        results: List[Dict[str, Any]]
+        results: List[Dict[str, Any]],
+        total_rows: int
     ) -> str:
-        """Generate natural language explanation"""
-        explanation_prompt = f"""
+        """Build the explanation prompt from the first rows and the row count"""
+        return f"""
 Given this analytics question and results, provide a concise summary.
 
 Question: {question}
-Results: {json.dumps(results[:5])}
-Total Rows: {len(results)}
+Results: {orjson.dumps(results[:5], default=str).decode()}
+Total Rows: {total_rows}
 
 Provide a 2-3 sentence summary.
 """
+    
+    @staticmethod
+    def _result_signature(head: List[Dict[str, Any]], total_rows: int) -> bytes:
+        """Fingerprint the rows an explanation is based on"""
+        return hashlib.blake2b(
+            orjson.dumps([total_rows, head], default=str), digest_size=16).digest()
+    
+    async def _explain_results(
+        self,
+        question: str,
+        sql: str,
+        results: List[Dict[str, Any]],
+        total_rows: Optional[int] = None
+    ) -> str:
+        """Generate natural language explanation"""
+        explanation_prompt = self._explanation_prompt(
+            question,
+            results,
+            total_rows if total_rows is not None else len(results)
+        )
         
         explanation = await self.explainer_agent.run_async(explanation_prompt)
         return explanation.strip()
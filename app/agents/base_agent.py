@@ -2,33 +2,231 @@
 Base agent with fallback system for multiple AI providers.
 """
 
+import asyncio
 import logging
+import operator
 import os
-from typing import Any, Dict, Optional, Union
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+import httpx
 from pydantic_ai import Agent
-from pydantic_ai.models.openai import OpenAIChatModel
-from pydantic_ai.providers.grok import GrokProvider
+from app.agents.cache import LLMCache, llm_cache
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Fallback order: Gemini (FREE) -> X.AI (Grok) -> OpenAI -> Anthropic
+_PROVIDER_ORDER = ('gemini', 'xai', 'openai', 'anthropic')
 
-class FallbackAgent:
+# Where different PydanticAI versions put the response text, in probe order
+_RESULT_ATTRS = ('data', 'output', 'content', 'message', 'text')
+# Stream chunks: a delta if the type has one, otherwise the full text so far
+_CHUNK_ATTRS = ('delta', 'data', 'content', 'text')
+
+_GETTERS = {attr: operator.attrgetter(attr) for attr in {*_RESULT_ATTRS, *_CHUNK_ATTRS}}
+_DELTA_GETTER = _GETTERS['delta']
+
+# Attribute getter per (type, probe order), so hasattr runs once per type
+_EXTRACTORS: Dict[Tuple[type, Tuple[str, ...]], Optional[Callable[[Any], Any]]] = {}
+
+
+def _extractor(obj: Any, attrs: Tuple[str, ...]) -> Optional[Callable[[Any], Any]]:
+    """Getter for the first of attrs that objects of this type have, or None."""
+    key = (type(obj), attrs)
+    try:
+        return _EXTRACTORS[key]
+    except KeyError:
+        name = next((attr for attr in attrs if hasattr(obj, attr)), None)
+        getter = _GETTERS[name] if name else None
+        _EXTRACTORS[key] = getter
+        return getter
+
+# Whether a stream result type offers stream_text(delta=True), per type
+_NATIVE_DELTA_TYPES: Dict[type, bool] = {}
+
+
+def _text_stream(result: Any) -> Tuple[Any, bool]:
     """
-    Agent that tries multiple AI providers with fallback support.
-    Tries OpenAI first, then X.AI (Grok), then Anthropic.
+    Iterator over a streamed run result, and whether it yields deltas.
+
+    PydanticAI's stream_text(delta=True) hands out only the new text. Older
+    result types only offer stream() (or are iterable themselves) and yield
+    the text so far, which run_stream has to diff.
     """
+    kind = type(result)
+    native = _NATIVE_DELTA_TYPES.get(kind)
+    if native is None:
+        native = _NATIVE_DELTA_TYPES[kind] = callable(getattr(kind, 'stream_text', None))
+    if native:
+        # run_stream does its own batching, so skip PydanticAI's debounce
+        return result.stream_text(delta=True, debounce_by=None), True
+    return (result.stream() if hasattr(result, 'stream') else result), False
 
-    def __init__(self, system_prompt: str):
-        """Initialize the fallback agent with system prompt."""
-        self.system_prompt = system_prompt
-        self.agents = self._setup_agents()
 
-    def _setup_agents(self) -> Dict[str, Optional[Agent]]:
-        """Setup all available AI agents based on API keys."""
-        agents = {}
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
 
-        # We can also use gemini-2.0-flash-exp it is totaly free
+
+# One keep-alive connection pool shared by the X.AI, OpenAI and Anthropic
+# providers of every FallbackAgent, so calls skip the TCP/TLS handshake.
+# Gemini goes through the google-genai client, which manages its own.
+# httpx pools are bound to the loop that first uses them, so the run_sync
+# loop gets its own client (and its own agents) instead of sharing this one.
+_HTTP_CLIENT = _new_http_client()
+_SYNC_HTTP_CLIENT = _new_http_client()
+
+
+async def close_http_client() -> None:
+    """Close the provider HTTP clients (call on app shutdown)."""
+    await _HTTP_CLIENT.aclose()
+    if _SYNC_LOOP is not None:
+        await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(_SYNC_HTTP_CLIENT.aclose(), _SYNC_LOOP))
+
+
+# Provider errors that won't clear up on the next call: auth and rate limits
+_TRIPPING_STATUS_CODES = (401, 403, 429)
+# Bad or revoked credentials: keys are only read at startup, so retrying
+# after a cooldown can't help
+_AUTH_STATUS_CODES = (401, 403)
+
+
+def _is_tripping_error(error: Exception) -> bool:
+    """Whether an error should open the provider's breaker straight away."""
+    return getattr(error, 'status_code', None) in _TRIPPING_STATUS_CODES
+
+
+def _is_auth_error(error: Exception) -> bool:
+    """Whether a provider error means its credentials are rejected."""
+    return getattr(error, 'status_code', None) in _AUTH_STATUS_CODES
+
+
+# Seconds a provider gets to answer (run_async) or start streaming
+# (run_stream) before we fall back to the next one
+_PROVIDER_TIMEOUTS = {'gemini': 20.0, 'xai': 30.0, 'openai': 30.0, 'anthropic': 30.0}
+_DEFAULT_PROVIDER_TIMEOUT = 30.0
+# Ceiling on a whole run_async call across fallbacks and backoff, so a
+# chain of slow providers can't hold a request for their summed timeouts
+_RUN_DEADLINE = 60.0
+
+# Exponential backoff with jitter before falling back after a 429, so a
+# burst of throttled requests doesn't hit the next provider in lockstep
+_BACKOFF_BASE = 0.5
+_BACKOFF_CAP = 4.0
+_BACKOFF_JITTER = 0.25
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    """Whether a provider error is a rate limit (HTTP 429)."""
+    return getattr(error, 'status_code', None) == 429
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Delay before the next provider after `attempt` earlier rate limits."""
+    return min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt) + random.uniform(0, _BACKOFF_JITTER)
+
+
+async def _call_provider(
+    run: Callable[[str], Awaitable[Any]],
+    user_input: str,
+    timeout: float,
+    delay: float = 0.0,
+) -> Any:
+    """Call a provider after an optional backoff delay, bounded by timeout."""
+    if delay:
+        await asyncio.sleep(delay)
+    return await asyncio.wait_for(run(user_input), timeout)
+
+
+class ProvidersUnavailableError(Exception):
+    """Raised without any provider call when every provider's circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one AI provider.
+
+    CLOSED lets calls through. After failure_threshold consecutive failures,
+    or one auth/rate-limit error, it goes OPEN and the provider is skipped
+    for open_duration seconds. It is then HALF_OPEN: a single probe call is
+    let through, which closes the breaker on success or re-opens it.
+    A DISABLED breaker (rejected credentials) stays shut until restart.
+    """
+
+    def __init__(self, failure_threshold: int = 5, open_duration: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.open_duration = open_duration
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.disabled = False
+
+    @property
+    def state(self) -> str:
+        """Current state: closed, open, half_open or disabled."""
+        if self.disabled:
+            return "disabled"
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.open_duration:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """Close the breaker after a successful call."""
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self, trip: bool = False) -> None:
+        """Count a failed call, opening the breaker if needed."""
+        self.failures += 1
+        self.probing = False
+        # A failed half-open probe re-opens straight away
+        if trip or self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def record_error(self, error: Exception) -> None:
+        """Count a provider error, disabling the provider on auth failures."""
+        if _is_auth_error(error):
+            self.record_failure(trip=True)
+            self.disabled = True
+        else:
+            self.record_failure(_is_tripping_error(error))
+
+    def abandon(self) -> None:
+        """Release a probe whose call was cancelled before it finished."""
+        self.probing = False
+
+
+_ENV_INITIALIZED = False
+_ENV_LOCK = threading.Lock()
+
+
+def _init_env() -> None:
+    """Publish provider API keys to the environment, once per process."""
+    global _ENV_INITIALIZED
+    if _ENV_INITIALIZED:
+        return
+    with _ENV_LOCK:
+        if _ENV_INITIALIZED:
+            return
         # Set environment variables for API keys
         if settings.OPENAI_API_KEY:
             os.environ['OPENAI_API_KEY'] = settings.OPENAI_API_KEY
@@ -38,13 +236,109 @@ class FallbackAgent:
             os.environ['ANTHROPIC_API_KEY'] = settings.ANTHROPIC_API_KEY
         if settings.GOOGLE_API_KEY:
             os.environ['GOOGLE_API_KEY'] = settings.GOOGLE_API_KEY
+        _ENV_INITIALIZED = True
+
+
+# PydanticAI agents keyed by (provider, model, system_prompt, for_sync_loop),
+# shared by every FallbackAgent built with the same prompt
+_AGENT_CACHE: Dict[Tuple[str, str, str, bool], Agent] = {}
+_AGENT_LOCK = threading.Lock()
+
+
+def _get_or_create_agent(key: Tuple[str, str, str, bool], factory: Callable[[], Agent]) -> Agent:
+    """Return the cached agent for key, building it with factory on first use."""
+    agent = _AGENT_CACHE.get(key)
+    if agent is None:
+        with _AGENT_LOCK:
+            agent = _AGENT_CACHE.get(key)
+            if agent is None:
+                agent = _AGENT_CACHE[key] = factory()
+    return agent
+
+
+# Event loop shared by run_sync callers, running in a daemon thread
+_SYNC_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_SYNC_LOOP_LOCK = threading.Lock()
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """Start the shared run_sync event loop on first use."""
+    global _SYNC_LOOP
+    with _SYNC_LOOP_LOCK:
+        if _SYNC_LOOP is None:
+            _SYNC_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_SYNC_LOOP.run_forever,
+                             name="fallback-agent-loop", daemon=True).start()
+        return _SYNC_LOOP
+
+
+class FallbackAgent:
+    """
+    Agent that tries multiple AI providers with fallback support.
+    Tries OpenAI first, then X.AI (Grok), then Anthropic.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str,
+        hedge_delay: Optional[float] = None,
+        stream_batch_size: int = 64,
+        stream_batch_interval: float = 0.02,
+    ):
+        """
+        Initialize the fallback agent with system prompt.
+        hedge_delay: latency SLO in seconds. run_async races one extra
+        provider against a call still unanswered after it, and run_stream
+        against one with no text yet; at most once per run (defaults to
+        AI_HEDGE_DELAY_SECONDS; 0 disables hedging).
+        stream_batch_size / stream_batch_interval: run_stream yields once
+        this many characters are buffered or this many seconds have passed.
+        """
+        self.system_prompt = system_prompt
+        self.stream_batch_size = stream_batch_size
+        self.stream_batch_interval = stream_batch_interval
+        if hedge_delay is None:
+            hedge_delay = settings.AI_HEDGE_DELAY_SECONDS
+        self.hedge_delay = hedge_delay if hedge_delay > 0 else None
+        self.agents = self._setup_agents()
+        # Only configured providers, in fallback order, resolved once
+        self._ordered_agents = [
+            (name, agent) for name in _PROVIDER_ORDER
+            if (agent := self.agents.get(name)) is not None
+        ]
+        # Bound run methods for run_async, so each call skips the attribute lookup
+        self._run_chain: List[Tuple[str, Callable[..., Awaitable[Any]]]] = [
+            (name, agent.run) for name, agent in self._ordered_agents
+        ]
+        # Same for run_sync, on agents bound to the run_sync loop's HTTP
+        # client; built on the first run_sync call
+        self._sync_run_chain: Optional[List[Tuple[str, Callable[..., Awaitable[Any]]]]] = None
+        # Skip providers that keep failing instead of paying their timeout
+        self._breakers: Dict[str, CircuitBreaker] = defaultdict(CircuitBreaker)
+        # Identical prompts are answered from memory instead of the network
+        self.response_cache: Optional[LLMCache] = (
+            llm_cache if settings.AI_RESPONSE_CACHE_TTL_SECONDS > 0 else None)
+
+    def _setup_agents(self, for_sync_loop: bool = False) -> Dict[str, Optional[Agent]]:
+        """
+        Setup all available AI agents based on API keys.
+        for_sync_loop builds them on the run_sync loop's HTTP client.
+        """
+        agents = {}
+        http_client = _SYNC_HTTP_CLIENT if for_sync_loop else _HTTP_CLIENT
+
+        # We can also use gemini-2.0-flash-exp it is totaly free
+        _init_env()
 
         # Google Gemini Agent (Primary - FREE!)
         if settings.GOOGLE_API_KEY:
             try:
-                agents['gemini'] = Agent(
-                    'gemini-2.0-flash',  # Free tier: 1500 requests/day
-                    system_prompt=self.system_prompt
+                agents['gemini'] = _get_or_create_agent(
+                    ('gemini', 'gemini-2.0-flash', self.system_prompt, for_sync_loop),
+                    lambda: Agent(
+                        'gemini-2.0-flash',  # Free tier: 1500 requests/day
+                        system_prompt=self.system_prompt
+                    )
                 )
                 logger.info("✅ Google Gemini 2.0 Flash agent configured (FREE)")
             except Exception as e:
@@ -57,13 +351,19 @@ class FallbackAgent:
         # X.AI Agent (Secondary - Paid)
         if settings.XAI_API_KEY:
             try:
-                xai_model = OpenAIChatModel(
-                    'grok-2-1212',  # Latest Grok model
-                    provider=GrokProvider(api_key=settings.XAI_API_KEY)
-                )
-                agents['xai'] = Agent(
-                    xai_model,
-                    system_prompt=self.system_prompt
+                # Provider SDKs are imported only when their key is set
+                from pydantic_ai.models.openai import OpenAIChatModel
+                from pydantic_ai.providers.grok import GrokProvider
+                agents['xai'] = _get_or_create_agent(
+                    ('xai', 'grok-2-1212', self.system_prompt, for_sync_loop),
+                    lambda: Agent(
+                        OpenAIChatModel(
+                            'grok-2-1212',  # Latest Grok model
+                            provider=GrokProvider(api_key=settings.XAI_API_KEY,
+                                                  http_client=http_client)
+                        ),
+                        system_prompt=self.system_prompt
+                    )
                 )
                 logger.info(
                     "✅ X.AI (Grok) agent configured with proper PydanticAI provider")
@@ -77,9 +377,18 @@ class FallbackAgent:
         # OpenAI Agent (Fallback #1 - Paid)
         if settings.OPENAI_API_KEY:
             try:
-                agents['openai'] = Agent(
-                    'openai:gpt-4o-mini',  # Use mini for cost efficiency
-                    system_prompt=self.system_prompt
+                from pydantic_ai.models.openai import OpenAIChatModel
+                from pydantic_ai.providers.openai import OpenAIProvider
+                agents['openai'] = _get_or_create_agent(
+                    ('openai', 'gpt-4o-mini', self.system_prompt, for_sync_loop),
+                    lambda: Agent(
+                        OpenAIChatModel(
+                            'gpt-4o-mini',  # Use mini for cost efficiency
+                            provider=OpenAIProvider(api_key=settings.OPENAI_API_KEY,
+                                                    http_client=http_client)
+                        ),
+                        system_prompt=self.system_prompt
+                    )
                 )
                 logger.info("✅ OpenAI agent configured")
             except Exception as e:
@@ -92,9 +401,18 @@ class FallbackAgent:
         # Anthropic Agent (Fallback #2 - Paid)
         if settings.ANTHROPIC_API_KEY:
             try:
-                agents['anthropic'] = Agent(
-                    'anthropic:claude-3-haiku-20240307',  # Use cheaper Haiku model
-                    system_prompt=self.system_prompt
+                from pydantic_ai.models.anthropic import AnthropicModel
+                from pydantic_ai.providers.anthropic import AnthropicProvider
+                agents['anthropic'] = _get_or_create_agent(
+                    ('anthropic', 'claude-3-haiku-20240307', self.system_prompt, for_sync_loop),
+                    lambda: Agent(
+                        AnthropicModel(
+                            'claude-3-haiku-20240307',  # Use cheaper Haiku model
+                            provider=AnthropicProvider(api_key=settings.ANTHROPIC_API_KEY,
+                                                       http_client=http_client)
+                        ),
+                        system_prompt=self.system_prompt
+                    )
                 )
                 logger.info("✅ Anthropic agent configured")
             except Exception as e:
@@ -111,48 +429,122 @@ class FallbackAgent:
         Run the query through available agents with fallback.
         Tries Gemini (FREE) -> X.AI (Grok) -> OpenAI -> Anthropic in order.
         """
-        providers = ['gemini', 'xai', 'openai', 'anthropic']
+        return await self._run(user_input, message_history, self._run_chain)
 
-        for provider in providers:
-            agent = self.agents.get(provider)
-            if agent is None:
-                logger.debug(f"Skipping {provider} - agent not available")
-                continue
+    async def _run(
+        self,
+        user_input: str,
+        message_history: Optional[list],
+        run_chain: List[Tuple[str, Callable[..., Awaitable[Any]]]],
+    ) -> str:
+        """
+        Run the query through run_chain's providers in order.
 
-            try:
-                logger.info(f"🤖 Trying {provider.upper()} agent...")
+        The next provider starts as soon as the current one fails. A call
+        still unanswered after hedge_delay seconds is raced (hedged) against
+        the next provider, once per run, so a slow call costs at most one
+        extra provider call. The first success wins and the loser is
+        cancelled.
+        """
+        cache_key = None
+        if self.response_cache is not None and message_history is None:
+            cache_key = self.response_cache.cache_key(self.system_prompt, user_input)
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Response cache hit")
+                return cached
+
+        chain = iter(run_chain)
+        running: Dict[asyncio.Task, str] = {}
+        tried: List[str] = []
+        rate_limited = 0
+        hedged = False
 
+        def start_next(delay: float = 0.0) -> None:
+            for provider, run in chain:
+                if not self._breakers[provider].allow():
+                    logger.debug(f"Skipping {provider} - circuit open")
+                    continue
+                logger.debug(f"🤖 Trying {provider.upper()} agent...")
                 # Use PydanticAI agent for all providers
-                result = await agent.run(user_input)
-                logger.info(f"✅ {provider.upper()} agent succeeded")
-
-                # Handle different PydanticAI result formats
-                # In newer versions, result might be a RunResult object
-                if hasattr(result, 'data'):
-                    return str(result.data)
-                elif hasattr(result, 'output'):
-                    return str(result.output)
-                elif hasattr(result, 'content'):
-                    return str(result.content)
-                elif hasattr(result, 'message'):
-                    return str(result.message)
-                elif hasattr(result, 'text'):
-                    return str(result.text)
-                else:
-                    # The result object itself might be the content
-                    logger.info(
-                        f"Result type: {type(result)}, attributes: {[attr for attr in dir(result) if not attr.startswith('_')]}")
-                    return str(result)
+                timeout = _PROVIDER_TIMEOUTS.get(provider, _DEFAULT_PROVIDER_TIMEOUT)
+                call = _call_provider(run, user_input, timeout, delay)
+                running[asyncio.create_task(call)] = provider
+                tried.append(provider)
+                return
 
-            except Exception as e:
-                logger.warning(f"❌ {provider.upper()} agent failed: {e}")
-                continue
+        start_next()
+        try:
+            async with asyncio.timeout(_RUN_DEADLINE):
+                while running:
+                    done, _ = await asyncio.wait(
+                        running, timeout=None if hedged else self.hedge_delay,
+                        return_when=asyncio.FIRST_COMPLETED)
+
+                    if not done:
+                        # Past the SLO: race the next provider, keep both running
+                        hedged = True
+                        start_next()
+                        continue
+
+                    for task in done:
+                        provider = running.pop(task)
+                        try:
+                            result = task.result()
+                        except asyncio.TimeoutError:
+                            logger.warning(f"❌ {provider.upper()} agent timed out")
+                            self._breakers[provider].record_failure()
+                            start_next()
+                            continue
+                        except Exception as e:
+                            logger.warning(f"❌ {provider.upper()} agent failed: {e}")
+                            self._breakers[provider].record_error(e)
+                            if _is_rate_limited(e):
+                                start_next(_backoff_delay(rate_limited))
+                                rate_limited += 1
+                            else:
+                                start_next()
+                            continue
+
+                        logger.info(f"✅ {provider.upper()} agent succeeded")
+                        self._breakers[provider].record_success()
+                        text = self._result_text(result)
+                        if cache_key is not None:
+                            await self.response_cache.set(cache_key, text)
+                        return text
+        except TimeoutError:
+            error_msg = f"AI providers did not answer within {_RUN_DEADLINE:g}s."
+            logger.error(error_msg)
+            raise Exception(error_msg) from None
+        finally:
+            for task, provider in running.items():
+                task.cancel()
+                self._breakers[provider].abandon()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
 
+        self._raise_if_all_open(tried, run_chain)
         # If all agents fail
         error_msg = "All AI providers failed. Please check your API keys and try again."
         logger.error(error_msg)
         raise Exception(error_msg)
 
+    @staticmethod
+    def _result_text(result: Any) -> str:
+        """
+        Extract the response text from a PydanticAI result.
+        The attribute differs between PydanticAI versions, so it is probed
+        once per result type and remembered.
+        """
+        getter = _extractor(result, _RESULT_ATTRS)
+        if getter is not None:
+            return str(getter(result))
+
+        # The result object itself might be the content
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Result type %s has no known text attribute", type(result).__name__)
+        return str(result)
+
     async def run_stream(self, user_input: str, message_history: Optional[list] = None):
         """
         Run the query through available agents with fallback, yielding chunks.
@@ -160,89 +552,247 @@ class FallbackAgent:
         
         Yields:
             Text chunks from the AI response
+
+        If the first provider hasn't produced text after hedge_delay seconds
+        the next one is started alongside it, at most once per run; the
+        first to stream text wins and the rest are cancelled. A prompt answered before (by either method)
+        is replayed from the response cache as a single chunk.
         """
-        providers = ['gemini', 'xai', 'openai', 'anthropic']
-        for provider in providers:
-            agent = self.agents.get(provider)
-            if agent is None:
-                logger.debug(f"Skipping {provider} - agent not available")
-                continue
+        cache_key = None
+        if self.response_cache is not None and message_history is None:
+            cache_key = self.response_cache.cache_key(self.system_prompt, user_input)
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Response cache hit (streaming)")
+                yield cached
+                return
 
-            try:
+        chain = iter(self._ordered_agents)
+        events: asyncio.Queue = asyncio.Queue()
+        running: Dict[str, asyncio.Task] = {}
+        tried: List[str] = []
+        rate_limited = 0
+
+        def start_next(delay: float = 0.0) -> None:
+            for provider, agent in chain:
+                if not self._breakers[provider].allow():
+                    logger.debug(f"Skipping {provider} - circuit open")
+                    continue
                 logger.info(f"🤖 Trying {provider.upper()} agent (streaming)...")
+                running[provider] = asyncio.create_task(
+                    self._stream_deltas(provider, agent, user_input, delay, events))
+                tried.append(provider)
+                return
+
+        # The first provider to produce text wins and the others are
+        # cancelled; until then a slow start is hedged, once
+        winner: Optional[str] = None
+        hedged = False
+        # Coalesce token deltas so downstream SSE framing runs per batch
+        # rather than per token
+        buffer: List[str] = []
+        buffered = 0
+        last_flush = time.monotonic()
+        # Everything yielded so far, for the response cache
+        streamed: List[str] = []
+
+        start_next()
+        try:
+            while running:
+                try:
+                    provider, kind, payload = await asyncio.wait_for(
+                        events.get(),
+                        self.hedge_delay if winner is None and not hedged else None)
+                except asyncio.TimeoutError:
+                    # No text yet: race the next provider against the slow one
+                    hedged = True
+                    start_next()
+                    continue
+
+                if provider not in running:
+                    continue  # Left over from a cancelled provider
+
+                if kind == "chunk":
+                    if winner is None:
+                        winner = provider
+                        for other in [p for p in running if p != provider]:
+                            running.pop(other).cancel()
+                            self._breakers[other].abandon()
+                    buffer.append(payload)
+                    buffered += len(payload)
+                    now = time.monotonic()
+                    if (buffered >= self.stream_batch_size
+                            or now - last_flush >= self.stream_batch_interval):
+                        batch = "".join(buffer)
+                        streamed.append(batch)
+                        yield batch
+                        buffer.clear()
+                        buffered = 0
+                        last_flush = now
+                    continue
+
+                del running[provider]
+                breaker = self._breakers[provider]
+                if kind == "done":
+                    if buffer:
+                        batch = "".join(buffer)
+                        streamed.append(batch)
+                        yield batch
 
-                # Use PydanticAI agent streaming
-                async with agent.run_stream(user_input) as result:
-                    logger.info(f"✅ {provider.upper()} agent streaming started")
-                    
-                    # PydanticAI v0.0.24+ uses .stream() method to get the iterator
-                    # or sometimes the result itself is iterable. 
-                    # The error 'got StreamedRunResult' suggests we need to call .stream()
-                    # or iterate over result.stream_text() / result.stream()
-                    
-                    # Try standard PydanticAI streaming pattern
-                    stream_iter = result.stream() if hasattr(result, 'stream') else result
-                    
-                    last_text = ""
-                    
-                    async for chunk in stream_iter:
-                        current_text = ""
-                        delta = None
-                        
-                        # Handle different PydanticAI chunk formats
-                        if hasattr(chunk, 'delta'):
-                            # Best case: we have the delta directly
-                            delta = chunk.delta
-                        elif hasattr(chunk, 'data'):
-                            current_text = str(chunk.data)
-                        elif hasattr(chunk, 'content'):
-                            current_text = chunk.content
-                        elif hasattr(chunk, 'text'):
-                            current_text = chunk.text
-                        elif isinstance(chunk, str):
-                            current_text = chunk
-                        else:
-                            current_text = str(chunk)
-                        
-                        # If we didn't get a delta but got full text, calculate delta
-                        if delta is None and current_text:
-                            if current_text.startswith(last_text):
-                                delta = current_text[len(last_text):]
-                            else:
-                                # Text changed completely or didn't append (unlikely for streaming)
-                                delta = current_text
-                            last_text = current_text
-                        
-                        if delta:
-                            yield delta
-                    
                     logger.info(f"✅ {provider.upper()} agent streaming completed")
+                    breaker.record_success()
+                    # Only complete answers are cached; a consumer that stops
+                    # early never gets here
+                    if cache_key is not None:
+                        await self.response_cache.set(cache_key, "".join(streamed))
                     return  # Successfully streamed, exit
 
-            except Exception as e:
-                logger.warning(f"❌ {provider.upper()} agent streaming failed: {e}")
-                continue
+                if isinstance(payload, asyncio.TimeoutError):
+                    logger.warning(f"❌ {provider.upper()} agent streaming timed out")
+                    breaker.record_failure()
+                else:
+                    logger.warning(f"❌ {provider.upper()} agent streaming failed: {payload}")
+                    breaker.record_error(payload)
+                if provider == winner:
+                    winner = None
+                if _is_rate_limited(payload):
+                    start_next(_backoff_delay(rate_limited))
+                    rate_limited += 1
+                else:
+                    start_next()
+        finally:
+            # The consumer may stop iterating mid-stream
+            for provider, task in running.items():
+                task.cancel()
+                self._breakers[provider].abandon()
+            if running:
+                await asyncio.gather(*running.values(), return_exceptions=True)
 
+        self._raise_if_all_open(tried, self._ordered_agents)
         # If all agents fail
         error_msg = "All AI providers failed. Please check your API keys and try again."
         logger.error(error_msg)
         raise Exception(error_msg)
 
+    @staticmethod
+    async def _stream_deltas(
+        provider: str,
+        agent: Agent,
+        user_input: str,
+        delay: float,
+        events: asyncio.Queue,
+    ) -> None:
+        """
+        Stream one provider's text deltas to run_stream.
+
+        Puts (provider, "chunk", delta) for each piece of new text, then
+        (provider, "done", None), or (provider, "error", exception).
+        """
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            # The timeout covers getting the stream started; once text
+            # flows it runs to completion
+            timeout = _PROVIDER_TIMEOUTS.get(provider, _DEFAULT_PROVIDER_TIMEOUT)
+            async with asyncio.timeout(timeout) as deadline, \
+                    agent.run_stream(user_input) as result:
+                deadline.reschedule(None)
+                logger.info(f"✅ {provider.upper()} agent streaming started")
+
+                stream_iter, native_deltas = _text_stream(result)
+
+                last_text = ""
+                async for chunk in stream_iter:
+                    current_text = ""
+                    delta = None
+
+                    if native_deltas:
+                        # stream_text(delta=True) yields just the new text
+                        delta = chunk
+                    # Otherwise handle the older chunk formats; the
+                    # attribute is resolved once per chunk type
+                    elif (getter := _extractor(chunk, _CHUNK_ATTRS)) is _DELTA_GETTER:
+                        # Best case: we have the delta directly
+                        delta = getter(chunk)
+                    elif getter is not None:
+                        value = getter(chunk)
+                        current_text = str(value) if value is not None else ""
+                    elif isinstance(chunk, str):
+                        current_text = chunk
+                    else:
+                        current_text = str(chunk)
+
+                    # If we didn't get a delta but got full text, calculate delta
+                    if delta is None and current_text:
+                        if current_text.startswith(last_text):
+                            delta = current_text[len(last_text):]
+                        else:
+                            # Text changed completely or didn't append (unlikely for streaming)
+                            delta = current_text
+                        last_text = current_text
+
+                    if delta:
+                        events.put_nowait((provider, "chunk", delta))
+        except Exception as e:
+            events.put_nowait((provider, "error", e))
+        else:
+            events.put_nowait((provider, "done", None))
+
+    def _raise_if_all_open(self, tried: List[str], chain: list) -> None:
+        """Fail fast with ProvidersUnavailableError if no provider was let through."""
+        if not tried and chain:
+            logger.error(f"All AI provider circuits open: {self.get_breaker_states()}")
+            raise ProvidersUnavailableError(
+                "All AI providers are temporarily unavailable. Please try again shortly.")
+
     def run_sync(self, user_input: str, message_history: Optional[list] = None) -> str:
         """
-        Synchronous version - use async version with asyncio for simplicity.
+        Synchronous version of run_async.
+        Runs on one persistent background loop rather than a new loop per
+        call, so HTTP clients and their connections survive between calls.
+        Raises RuntimeError when called from inside a running event loop.
         """
-        import asyncio
-        return asyncio.run(self.run_async(user_input, message_history))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # Blocking a running loop on the result could deadlock its caller
+            raise RuntimeError("run_sync cannot be called from async code; await run_async instead")
+        loop = _get_sync_loop()
+
+        if self._sync_run_chain is None:
+            sync_agents = self._setup_agents(for_sync_loop=True)
+            self._sync_run_chain = [
+                (name, sync_agents[name].run) for name, _ in self._ordered_agents]
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(user_input, message_history, self._sync_run_chain), loop)
+        return future.result()
 
     def get_available_providers(self) -> list:
-        """Get list of available providers."""
+        """Get list of providers that would be tried right now.
+
+        Providers whose breaker is disabled, or open and still cooling down,
+        are left out; a half-open breaker counts as available.
+        """
         available = []
         for provider, agent in self.agents.items():
-            if agent is not None:
-                available.append(provider)
+            if agent is None:
+                continue
+            if self._breakers[provider].state in ("open", "disabled"):
+                continue
+            available.append(provider)
         return available
 
     def get_status(self) -> Dict[str, bool]:
         """Get status of all providers."""
         return {provider: agent is not None for provider, agent in self.agents.items()}
+
+    def get_provider_timeouts(self) -> Dict[str, float]:
+        """Per-attempt timeout in seconds of each configured provider, in fallback order."""
+        return {provider: _PROVIDER_TIMEOUTS.get(provider, _DEFAULT_PROVIDER_TIMEOUT)
+                for provider, _ in self._ordered_agents}
+
+    def get_breaker_states(self) -> Dict[str, str]:
+        """Get circuit breaker state (closed/open/half_open) of configured providers."""
+        return {provider: self._breakers[provider].state for provider, _ in self._ordered_agents}
@@ -0,0 +1,57 @@
+"""
+Response cache for AI provider calls.
+"""
+
+import hashlib
+from typing import Optional
+import orjson
+from cachetools import TTLCache
+from app.config import settings
+
+
+class LLMCache:
+    """
+    In-memory LRU + TTL cache of AI responses.
+
+    Keys cover the system prompt and the user input, so prompts that embed
+    patient or visit data miss as soon as that data changes. The get/set
+    interface is async so a shared backend (e.g. Redis) can replace the
+    in-process store without touching callers.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 3600):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+
+    @staticmethod
+    def cache_key(system_prompt: str, user_input: str) -> bytes:
+        """
+        Build the cache key for a system prompt / user input pair.
+
+        orjson and a 16-byte blake2b digest keep this cheap for prompts that
+        embed large patient histories. Use .hex() if a backend needs str keys.
+        """
+        payload = orjson.dumps({"sp": system_prompt, "input": user_input},
+                               option=orjson.OPT_SORT_KEYS)
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    async def get(self, key: bytes) -> Optional[str]:
+        """Get a cached response, or None on a miss or after expiry."""
+        return self._cache.get(key)
+
+    async def set(self, key: bytes, value: str) -> None:
+        """Store a response."""
+        self._cache[key] = value
+
+    def clear(self) -> None:
+        """Drop every cached response."""
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+# Shared by every FallbackAgent; keys include the system prompt
+llm_cache = LLMCache(
+    maxsize=settings.AI_RESPONSE_CACHE_SIZE,
+    ttl_seconds=settings.AI_RESPONSE_CACHE_TTL_SECONDS,
+)
@@ -2,40 +2,145 @@
 Question-answering agent using fallback system with Grok-3 primary.
 """
 
+import asyncio
+import heapq
 import logging
-from typing import List, Dict, Any, Optional
+import re
+import textwrap
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from datetime import datetime
-from pydantic import BaseModel
-from app.agents.base_agent import FallbackAgent
+from app.agents.base_agent import FallbackAgent, ProvidersUnavailableError
+from app.agents.qa_cache import QAAnswerCache, qa_answer_cache
+from app.agents.templates import (
+    COMPARE_QUESTION, INSIGHTS_QUESTION, QA_BARE_PROMPT, QA_PROMPT, QA_QUESTIONS_PROMPT)
 from app.models.visit import VisitResponse
 from app.models.patient import PatientResponse
 
 logger = logging.getLogger(__name__)
 
+# Prompt context is packed into a token budget, estimated at ~4 characters
+# per token; the counts are only ceilings on how many records are considered
+_CHARS_PER_TOKEN = 4
+_PATIENT_TOKEN_BUDGET = 1500
+_VISIT_TOKEN_BUDGET = 6000
+_MAX_PROMPT_PATIENTS = 10
+_MAX_PROMPT_VISITS = 25
 
-class QAContext(BaseModel):
-    """Context for Q&A agent."""
-    patients: Optional[List[PatientResponse]] = None
-    visits: Optional[List[VisitResponse]] = None
-    specific_patient: Optional[PatientResponse] = None
-    specific_visit: Optional[VisitResponse] = None
+# Free-text fields that dominate a record's size in the prompt
+_PATIENT_TEXT_FIELDS = ('medical_history', 'allergies', 'current_medications')
+_VISIT_TEXT_FIELDS = ('chief_complaint', 'diagnosis', 'treatment_plan',
+                      'doctor_notes', 'vital_signs', 'lab_results')
+# Rough cost of a record's fixed lines (name, dates, labels)
+_RECORD_BASE_TOKENS = 25
 
+# Default ceiling on concurrent provider calls for the batch helpers
+_BATCH_CONCURRENCY = 10
 
-class QAResponse(BaseModel):
-    """Structured Q&A response."""
-    answer: str
-    sources: List[Dict[str, Any]]
-    confidence_score: float
-    context_used: str
-    provider_used: str  # Which AI provider was used
 
+def _visit_date(visit):
+    """Visit date from a VisitResponse or a visit dict."""
+    return visit["visit_date"] if isinstance(visit, dict) else visit.visit_date
 
-class MedicalQAAgent:
-    """Agent for answering questions about patient data with AI provider fallback."""
 
-    def __init__(self):
-        """Initialize the medical QA agent."""
-        system_prompt = """
+def _field(record, name):
+    """Field value from a response model or a dict, None if missing."""
+    return record.get(name) if isinstance(record, dict) else getattr(record, name, None)
+
+
+def _estimated_tokens(record, fields) -> int:
+    """Approximate prompt tokens a record will take."""
+    chars = sum(len(str(value)) for name in fields if (value := _field(record, name)))
+    return _RECORD_BASE_TOKENS + chars // _CHARS_PER_TOKEN
+
+
+def _pack(records, fields, budget: int):
+    """
+    Take records in order while their estimated size fits the budget.
+
+    The first record is always kept, so a single oversized visit still
+    gives the model something to answer from.
+    """
+    packed = []
+    used = 0
+    for record in records:
+        cost = _estimated_tokens(record, fields)
+        if packed and used + cost > budget:
+            break
+        packed.append(record)
+        used += cost
+    return packed
+
+
+def _prompt_patients(patients):
+    """Patients for the prompt, in the caller's order, within budget."""
+    if not patients:
+        return patients
+    return _pack(patients[:_MAX_PROMPT_PATIENTS], _PATIENT_TEXT_FIELDS, _PATIENT_TOKEN_BUDGET)
+
+
+def _recent_visits(visits):
+    """
+    Pick the most recent visits that fit the prompt budget.
+
+    heapq.nlargest keeps only the top entries, and being stable it returns
+    them in the services' newest-first order; short visits let more of the
+    history in, long notes fewer.
+    """
+    if not visits:
+        return visits
+    newest = heapq.nlargest(_MAX_PROMPT_VISITS, visits, key=_visit_date)
+    return _pack(newest, _VISIT_TEXT_FIELDS, _VISIT_TOKEN_BUDGET)
+
+
+def _prompt_context(patients, visits) -> Dict[str, Any]:
+    """
+    Template variables for the patient/visit context.
+
+    The count of visits left out is passed along so the prompt can tell the
+    model the history it sees is partial.
+    """
+    recent = _recent_visits(visits)
+    return {
+        "patients": _prompt_patients(patients),
+        "visits": recent,
+        "omitted_visits": len(visits) - len(recent) if visits else 0,
+    }
+
+
+# Heading that starts each answer in a multi-question reply
+_ANSWER_MARKER = re.compile(r"^#{1,6}[ \t]*Answer[ \t]+(\d+)[ \t]*:?[ \t]*$", re.MULTILINE)
+
+
+def _split_answers(reply: str, count: int) -> Optional[List[str]]:
+    """
+    Split a multi-question reply on its "### Answer <n>" headings.
+
+    Returns None unless every question 1..count got exactly one answer.
+    """
+    parts = _ANSWER_MARKER.split(reply)
+    # parts = [preamble, n1, text1, n2, text2, ...]
+    answers: Dict[int, str] = {}
+    for number, text in zip(parts[1::2], parts[2::2]):
+        index = int(number)
+        if index in answers or not 1 <= index <= count:
+            return None
+        answers[index] = text.strip()
+    if len(answers) != count:
+        return None
+    return [answers[i] for i in range(1, count + 1)]
+
+
+# Returned straight away while every provider's circuit breaker is open
+_UNAVAILABLE_ANSWER = (
+    "The AI assistant is temporarily unavailable because its AI providers are "
+    "failing. Please try again in a minute."
+)
+
+# Sent as the system message of every QA request. It is kept byte-identical
+# across calls (and ahead of the per-request context) so providers can reuse
+# their cached prefix. Dedented so source indentation isn't billed as tokens.
+_SYSTEM_PROMPT = textwrap.dedent("""
         You are a medical assistant AI that helps healthcare professionals find information about patients and their visits.
         
         Your role is to:
@@ -98,11 +203,56 @@ class MedicalQAAgent:
         - Context clarification
         - Use Markdown tables for any structured data (vital signs, lab results, etc.)
         - Use Mermaid diagrams when visualization would enhance understanding
-        """
+        """).strip()
+
+@dataclass(slots=True)
+class QAResponse:
+    """
+    Structured Q&A response.
+
+    A plain slotted dataclass: it is built from trusted values on every
+    legacy answer_question call, so pydantic validation buys nothing.
+    """
+    answer: str
+    sources: List[Dict[str, Any]]
+    confidence_score: float
+    context_used: str
+    provider_used: str  # Which AI provider was used
 
-        self.agent = FallbackAgent(system_prompt)
+    def model_dump(self) -> Dict[str, Any]:
+        """Dict form, kept for callers written against the pydantic model."""
+        return asdict(self)
+
+
+class MedicalQAAgent:
+    """Agent for answering questions about patient data with AI provider fallback."""
+
+    def __init__(self):
+        """Initialize the medical QA agent."""
+        self.agent = FallbackAgent(_SYSTEM_PROMPT)
+        # Repeat questions over unchanged data skip the provider call
+        self.answer_cache: Optional[QAAnswerCache] = qa_answer_cache
         logger.info("Medical QA Agent initialized with fallback system")
 
+    @staticmethod
+    def _build_prompt(
+        question: str,
+        patients: Optional[List[PatientResponse]],
+        visits: Optional[List[VisitResponse]],
+        patient_id: Optional[str] = None,
+        visit_id: Optional[str] = None
+    ) -> str:
+        """
+        Build the user prompt shared by answer_question and
+        answer_question_stream, so both send byte-identical context.
+
+        Without patient or visit records only the question and IDs are sent.
+        """
+        if not patients and not visits:
+            return QA_BARE_PROMPT.render(
+                question=question, patient_id=patient_id, visit_id=visit_id)
+        return QA_PROMPT.render(question=question, **_prompt_context(patients, visits))
+
     async def answer_question(
         self,
         question: str,
@@ -124,103 +274,27 @@ class MedicalQAAgent:
         Returns:
             AI-generated answer string
         """
-        # Build context information
-        context_parts = [f"Question: {question}"]
-
-        def safe_get_attr(obj, attr_name, default="Unknown"):
-            """Safely get attribute from either dict or object."""
-            if hasattr(obj, attr_name):
-                return getattr(obj, attr_name, default)
-            elif isinstance(obj, dict):
-                return obj.get(attr_name, default)
-            else:
-                return default
-
-        if patients:
-            context_parts.append("Patient Information:")
-            # Limit to 5 patients to avoid token limits
-            for patient in patients[:5]:
-                first_name = safe_get_attr(patient, 'first_name')
-                last_name = safe_get_attr(patient, 'last_name')
-                date_of_birth = safe_get_attr(patient, 'date_of_birth')
-                medical_history = safe_get_attr(
-                    patient, 'medical_history', None)
-                allergies = safe_get_attr(patient, 'allergies', None)
-                current_medications = safe_get_attr(
-                    patient, 'current_medications', None)
-
-                context_parts.append(
-                    f"- Patient {first_name} {last_name} (DOB: {date_of_birth})")
-                if medical_history:
-                    context_parts.append(
-                        f"  Medical History: {medical_history}")
-                if allergies:
-                    context_parts.append(f"  Allergies: {allergies}")
-                if current_medications:
-                    context_parts.append(
-                        f"  Current Medications: {current_medications}")
-
-        if visits:
-            context_parts.append("Visit Information:")
-            for visit in visits[:10]:  # Limit to 10 visits
-                visit_date = safe_get_attr(visit, 'visit_date')
-                visit_type = safe_get_attr(visit, 'visit_type')
-                chief_complaint = safe_get_attr(
-                    visit, 'chief_complaint', 'N/A')
-                diagnosis = safe_get_attr(visit, 'diagnosis', 'N/A')
-                treatment_plan = safe_get_attr(visit, 'treatment_plan', 'N/A')
-                vital_signs = safe_get_attr(visit, 'vital_signs', None)
-                lab_results = safe_get_attr(visit, 'lab_results', None)
-                doctor_notes = safe_get_attr(visit, 'doctor_notes', None)
-
-                context_parts.append(f"- Visit {visit_date} ({visit_type})")
-                context_parts.append(f"  Chief Complaint: {chief_complaint}")
-                context_parts.append(f"  Diagnosis: {diagnosis}")
-                context_parts.append(f"  Treatment: {treatment_plan}")
-                # context_parts.append(f"  Duration: {visit.duration_minutes} minutes")
-
-                # Add formatted vital signs table if available
-                if vital_signs:
-                    from app.services.formatting_service import medical_formatter
-                    logger.debug(
-                        f"Processing vital signs, type: {type(vital_signs)}")
-                    vital_signs_table = medical_formatter.format_vital_signs_markdown(
-                        vital_signs)
-                    context_parts.append(f"  {vital_signs_table}")
-
-                # Add formatted lab results table if available
-                if lab_results:
-                    from app.services.formatting_service import medical_formatter
-                    logger.debug(
-                        f"Processing lab results, type: {type(lab_results)}, content: {lab_results}")
-                    lab_results_table = medical_formatter.format_lab_results_markdown(
-                        lab_results)
-                    logger.debug(
-                        f"Formatted lab results table: {lab_results_table[:200]}")
-                    context_parts.append(f"  {lab_results_table}")
-                else:
-                    logger.debug(f"No lab results available for this visit")
-
-                if doctor_notes:
-                    context_parts.append(f"  Notes: {doctor_notes}")
-
-        context_parts.append(
-    "\nPlease answer the question based on the provided medical data. "
-    "IMPORTANT: When vital signs or lab results are provided as Markdown tables in the context above, "
-    "you MUST reproduce those exact tables in your response. Do not summarize table data into sentences. "
-    "Copy the table format exactly as shown. "
-        "Cite the visit date once at the beginning of your answer, not after every line. "
-
-    "Be specific about which information you're referencing and provide appropriate sources."
-)
-        full_prompt = "\n".join(context_parts)
+        full_prompt = self._build_prompt(question, patients, visits, patient_id, visit_id)
+
+        cache_key = None
+        if self.answer_cache is not None:
+            cache_key = self.answer_cache.cache_key(question, full_prompt)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("QA answer cache hit")
+                return cached
 
         try:
             # Use the fallback agent (Grok-3 -> OpenAI -> Anthropic)
             response = await self.agent.run_async(full_prompt)
             logger.info(
                 f"QA Agent successfully answered question about patient {patient_id}")
+            if cache_key is not None:
+                self.answer_cache.set(cache_key, response)
             return response
+        except ProvidersUnavailableError:
+            logger.warning("QA Agent skipped provider call: all circuits open")
+            return _UNAVAILABLE_ANSWER
         except Exception as e:
             logger.error(f"Error in QA agent: {e}")
             return f"I apologize, but I encountered an error while processing your question. Please try again or contact support. Error: {str(e)}"
@@ -246,75 +320,7 @@ class MedicalQAAgent:
         Yields:
             Text chunks of the AI-generated answer
         """
-        # Build context information (same as non-streaming version)
-        context_parts = [f"Question: {question}"]
-
-        def safe_get_attr(obj, attr_name, default="Unknown"):
-            """Safely get attribute from either dict or object."""
-            if hasattr(obj, attr_name):
-                return getattr(obj, attr_name, default)
-            elif isinstance(obj, dict):
-                return obj.get(attr_name, default)
-            else:
-                return default
-
-        if patients:
-            context_parts.append("Patient Information:")
-            for patient in patients[:5]:
-                first_name = safe_get_attr(patient, 'first_name')
-                last_name = safe_get_attr(patient, 'last_name')
-                date_of_birth = safe_get_attr(patient, 'date_of_birth')
-                medical_history = safe_get_attr(patient, 'medical_history', None)
-                allergies = safe_get_attr(patient, 'allergies', None)
-                current_medications = safe_get_attr(patient, 'current_medications', None)
-
-                context_parts.append(f"- Patient {first_name} {last_name} (DOB: {date_of_birth})")
-                if medical_history:
-                    context_parts.append(f"  Medical History: {medical_history}")
-                if allergies:
-                    context_parts.append(f"  Allergies: {allergies}")
-                if current_medications:
-                    context_parts.append(f"  Current Medications: {current_medications}")
-
-        if visits:
-            context_parts.append("Visit Information:")
-            for visit in visits[:10]:
-                visit_date = safe_get_attr(visit, 'visit_date')
-                visit_type = safe_get_attr(visit, 'visit_type')
-                chief_complaint = safe_get_attr(visit, 'chief_complaint', 'N/A')
-                diagnosis = safe_get_attr(visit, 'diagnosis', 'N/A')
-                treatment_plan = safe_get_attr(visit, 'treatment_plan', 'N/A')
-                vital_signs = safe_get_attr(visit, 'vital_signs', None)
-                lab_results = safe_get_attr(visit, 'lab_results', None)
-                doctor_notes = safe_get_attr(visit, 'doctor_notes', None)
-                duration_minutes = safe_get_attr(visit, 'duration_minutes', None)
-
-                context_parts.append(f"- Visit {visit_date} ({visit_type})")
-                context_parts.append(f"  Chief Complaint: {chief_complaint}")
-                context_parts.append(f"  Diagnosis: {diagnosis}")
-                context_parts.append(f"  Treatment: {treatment_plan}")
-
-                if vital_signs:
-                    from app.services.formatting_service import medical_formatter
-                    vital_signs_table = medical_formatter.format_vital_signs_markdown(vital_signs)
-                    context_parts.append(f"  {vital_signs_table}")
-
-                if lab_results:
-                    from app.services.formatting_service import medical_formatter
-                    lab_results_table = medical_formatter.format_lab_results_markdown(lab_results)
-                    context_parts.append(f"  {lab_results_table}")
-
-                if doctor_notes:
-                    context_parts.append(f"  Notes: {doctor_notes}")
-
-                if duration_minutes:
-                    context_parts.append(f"  Duration: {duration_minutes} minutes")
-
-        context_parts.append(
-            "\nPlease answer the question based on the provided medical data. "
-            "Be specific about which information you're referencing and provide appropriate sources.")
-
-        full_prompt = "\n".join(context_parts)
+        full_prompt = self._build_prompt(question, patients, visits, patient_id, visit_id)
 
         try:
             # Stream the response using the fallback agent
@@ -322,15 +328,80 @@ class MedicalQAAgent:
                 yield chunk
             
             logger.info(f"QA Agent successfully streamed answer about patient {patient_id}")
+        except ProvidersUnavailableError:
+            logger.warning("QA Agent skipped provider stream: all circuits open")
+            yield _UNAVAILABLE_ANSWER
         except Exception as e:
             logger.error(f"Error in QA agent streaming: {e}")
             yield f"I apologize, but I encountered an error while processing your question. Error: {str(e)}"
 
+    async def batch_answer(
+        self,
+        questions: List[Tuple[str, Dict[str, Any]]],
+        *,
+        concurrency: int = _BATCH_CONCURRENCY
+    ) -> List[str]:
+        """
+        Answer independent questions concurrently.
+
+        Each item is (question, kwargs for answer_question), e.g.
+        ("Any allergies?", {"patients": [patient]}). At most ``concurrency``
+        provider calls are in flight at once; answers keep input order.
+        """
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(question: str, kwargs: Dict[str, Any]) -> str:
+            async with sem:
+                return await self.answer_question(question, **kwargs)
+
+        return await asyncio.gather(*[_one(q, kw) for q, kw in questions])
+
+    async def answer_questions(
+        self,
+        questions: List[str],
+        patients: Optional[List[PatientResponse]] = None,
+        visits: Optional[List[VisitResponse]] = None
+    ) -> List[str]:
+        """
+        Answer several questions about the same patients/visits in one call.
+
+        The shared context is rendered and sent once instead of once per
+        question. If the reply can't be split into one answer per question,
+        the questions are answered separately via batch_answer.
+        """
+        if len(questions) <= 1:
+            return [await self.answer_question(q, patients=patients, visits=visits)
+                    for q in questions]
+
+        prompt = QA_QUESTIONS_PROMPT.render(
+            questions=questions, **_prompt_context(patients, visits))
+
+        try:
+            reply = await self.agent.run_async(prompt)
+        except ProvidersUnavailableError:
+            logger.warning("QA Agent skipped provider call: all circuits open")
+            return [_UNAVAILABLE_ANSWER] * len(questions)
+        except Exception as e:
+            logger.error(f"Error in QA agent: {e}")
+            return [f"I apologize, but I encountered an error while processing your question. Please try again or contact support. Error: {str(e)}"] * len(questions)
+
+        answers = _split_answers(reply, len(questions))
+        if answers is None:
+            logger.warning(
+                "Could not split combined answer for %d questions; answering separately",
+                len(questions))
+            context = {"patients": patients, "visits": visits}
+            return await self.batch_answer([(q, context) for q in questions])
+
+        logger.info(f"QA Agent answered {len(questions)} questions in one call")
+        return answers
+
     def get_agent_status(self) -> dict:
         """Get the status of all available AI providers."""
         return {
             "available_providers": self.agent.get_available_providers(),
-            "provider_status": self.agent.get_status()
+            "provider_status": self.agent.get_status(),
+            "breaker_states": self.agent.get_breaker_states()
         }
 
     def get_fallback_info(self) -> dict:
@@ -341,6 +412,8 @@ class MedicalQAAgent:
             "provider_order": ["xai", "openai", "anthropic"],
             "available_providers": status["available_providers"],
             "provider_status": status["provider_status"],
+            "breaker_states": status["breaker_states"],
+            "provider_timeouts": self.agent.get_provider_timeouts(),
             "total_available": len(status["available_providers"])
         }
 
@@ -369,6 +442,7 @@ async def answer_question(
             visits=visits
         )
 
+        providers = medical_qa_agent.agent.get_available_providers()
         # Create a structured response for backward compatibility
         return QAResponse(
             answer=answer,
@@ -376,8 +450,7 @@ async def answer_question(
                       "content": "Generated using AI fallback system"}],
             confidence_score=0.8,  # Default confidence
             context_used=f"Patients: {len(patients) if patients else 0}, Visits: {len(visits) if visits else 0}",
-            provider_used=medical_qa_agent.agent.get_available_providers(
-            )[0] if medical_qa_agent.agent.get_available_providers() else "none"
+            provider_used=providers[0] if providers else "none"
         )
     except Exception as e:
         logger.error(f"Error in legacy answer_question: {e}")
@@ -397,7 +470,7 @@ async def get_patient_insights(
     """
     Get AI insights about a patient's health trends and patterns.
     """
-    question = f"Please analyze the health trends and patterns for patient {patient.first_name} {patient.last_name} based on their visit history. Provide insights about their overall health trajectory, any concerning patterns, and recommendations for continued care."
+    question = INSIGHTS_QUESTION.render(patient=patient)
 
     return await medical_qa_agent.answer_question(
         question=question,
@@ -407,6 +480,24 @@ async def get_patient_insights(
     )
 
 
+async def get_patient_insights_stream(
+    patient: PatientResponse,
+    visits: List[VisitResponse]
+) -> AsyncIterator[str]:
+    """
+    Stream AI insights about a patient's health trends as they are generated.
+    """
+    question = INSIGHTS_QUESTION.render(patient=patient)
+
+    async for chunk in medical_qa_agent.answer_question_stream(
+        question=question,
+        patient_id=patient.patient_id,
+        patients=[patient],
+        visits=visits
+    ):
+        yield chunk
+
+
 async def compare_visits(
     visit1: VisitResponse,
     visit2: VisitResponse
@@ -414,9 +505,80 @@ async def compare_visits(
     """
     Compare two visits to identify changes and improvements.
     """
-    question = f"Please compare these two visits and identify key changes, improvements, or concerning developments between visit {visit1.visit_date} and visit {visit2.visit_date}."
+    question = COMPARE_QUESTION.render(visit1=visit1, visit2=visit2)
 
     return await medical_qa_agent.answer_question(
         question=question,
         visits=[visit1, visit2]
     )
+
+
+async def compare_visits_stream(
+    visit1: VisitResponse,
+    visit2: VisitResponse
+) -> AsyncIterator[str]:
+    """
+    Stream a comparison of two visits as it is generated.
+    """
+    question = COMPARE_QUESTION.render(visit1=visit1, visit2=visit2)
+
+    async for chunk in medical_qa_agent.answer_question_stream(
+        question=question,
+        visits=[visit1, visit2]
+    ):
+        yield chunk
+
+
+async def get_patient_insights_batch(
+    pairs: List[Tuple[PatientResponse, List[VisitResponse]]],
+    *,
+    concurrency: int = _BATCH_CONCURRENCY
+) -> List[str]:
+    """
+    Get insights for many patients concurrently.
+
+    Latency is roughly that of the slowest call rather than the sum of all
+    of them. At most ``concurrency`` requests are in flight at once, so a
+    large batch does not trip provider rate limits. Results are returned in
+    the order of ``pairs``.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(patient: PatientResponse, visits: List[VisitResponse]) -> str:
+        async with sem:
+            return await get_patient_insights(patient, visits)
+
+    return await asyncio.gather(*[_one(p, v) for p, v in pairs])
+
+
+async def get_patients_insights(
+    patients: List[PatientResponse],
+    visits_by_pid: Dict[int, List[VisitResponse]],
+    *,
+    concurrency: int = _BATCH_CONCURRENCY
+) -> List[str]:
+    """
+    Get insights for several patients concurrently.
+
+    visits_by_pid maps each patient's database id to their visits.
+    """
+    return await get_patient_insights_batch(
+        [(patient, visits_by_pid.get(patient.id, [])) for patient in patients],
+        concurrency=concurrency)
+
+
+async def compare_visits_batch(
+    pairs: List[Tuple[VisitResponse, VisitResponse]],
+    *,
+    concurrency: int = _BATCH_CONCURRENCY
+) -> List[str]:
+    """
+    Compare many visit pairs concurrently, bounded like get_patient_insights_batch.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(visit1: VisitResponse, visit2: VisitResponse) -> str:
+        async with sem:
+            return await compare_visits(visit1, visit2)
+
+    return await asyncio.gather(*[_one(v1, v2) for v1, v2 in pairs])
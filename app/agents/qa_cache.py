@@ -0,0 +1,60 @@
+"""
+Answer cache for the Q&A agent.
+"""
+
+import hashlib
+from typing import Optional
+from cachetools import TTLCache
+from app.config import settings
+
+
+class QAAnswerCache:
+    """
+    In-memory TTL cache of Q&A answers keyed on the question and its context.
+
+    Questions are normalized (case, whitespace, trailing punctuation), so a
+    repeat such as "Any allergies?" / "any allergies" is served without a
+    provider call. The patient and visit context must match exactly.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 3600):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        """Drop case, whitespace and trailing punctuation."""
+        return ''.join(question.lower().split()).rstrip('?.!')
+
+    def cache_key(self, question: str, prompt: str) -> bytes:
+        """
+        Build the key for a question and the prompt rendered from it.
+
+        The prompt's first line is the raw question, so only the rest of it
+        (the patient/visit context and instructions) goes into the key.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self._normalize_question(question).encode())
+        digest.update(b'\0')
+        digest.update(prompt.partition('\n')[2].encode())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """Get a cached answer, or None on a miss or after expiry."""
+        return self._cache.get(key)
+
+    def set(self, key: bytes, answer: str) -> None:
+        """Store an answer."""
+        self._cache[key] = answer
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+qa_answer_cache: Optional[QAAnswerCache] = (
+    QAAnswerCache(maxsize=settings.QA_CACHE_SIZE, ttl_seconds=settings.QA_CACHE_TTL_SECONDS)
+    if settings.QA_CACHE_TTL_SECONDS > 0 else None
+)
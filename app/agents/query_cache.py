@@ -1,59 +1,125 @@
-from typing import Dict, Optional
-import hashlib
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Callable, Optional
+import asyncio
+import heapq
+import time
+from app.agents.sqlite_cache import SQLiteQueryStore
 
 
 class QueryCache:
     """
-    In memory cache for SQL queries.
-    Stores question -> SQL mapping with TTL.
+    Cache for SQL queries.
+    Stores question -> SQL mapping with TTL in memory, evicting the least
+    recently used entry past max_size.
+    With a store, SQL is also written to SQLite and read back on a memory
+    miss, so a restart starts warm. The blocking SQLite calls run in a
+    worker thread, never on the event loop. SQL read back from disk is
+    passed through `validate` before use, since the file may hold anything.
+    Without a store nothing is persisted and get/set only touch memory.
     """
-    def __init__(self, ttl_hours:int=24):
-        self.cache: Dict[str,dict] = {}
-        self.ttl = timedelta(hours=ttl_hours)
+    def __init__(self, ttl_hours:int=24, max_size:int=10000,
+                 store:Optional[SQLiteQueryStore]=None,
+                 validate:Optional[Callable[[str], bool]]=None):
+        self.cache: OrderedDict[str,dict] = OrderedDict()
+        # Monotonic seconds: cheaper to compare than datetimes, and
+        # immune to wall-clock changes
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_size = max_size
+        self.store = store
+        self.validate = validate
+        # Lifetime lookup counts for the hit rate
+        self.hits = 0
+        self.misses = 0
 
     
     def _normalize_question(self, question:str):
         """ Normalize the question to create cache key """
-        normalized = ''.join(question.lower().strip().split())
+        # Case, whitespace and trailing punctuation don't change the SQL
+        normalized = ''.join(question.lower().split()).rstrip('?.!')
         return normalized
 
     def _get_cache_key(self, question:str):
         """ Get the cache key for question """
-        normalized = self._normalize_question(question)
-        return hashlib.md5(normalized.encode()).hexdigest()
+        # Questions are short, so the normalized text is the key itself;
+        # the dict hashes it without an encode() or digest per lookup
+        return self._normalize_question(question)
     
-    def get(self,question:str):
+    async def get(self,question:str):
         """ Get the SQL query for question from cache """
         cache_key = self._get_cache_key(question)
 
         if cache_key not in self.cache:
+            if self.store is not None:
+                row = await asyncio.to_thread(self.store.get, cache_key)
+                if row and (self.validate is None or self.validate(row[1])):
+                    question, sql, expires_at = row
+                    # The store keeps wall-clock expiry; memory uses monotonic
+                    self._insert(cache_key, question, sql,
+                                 time.monotonic() + expires_at - time.time())
+                    self.hits += 1
+                    self.cache[cache_key]['hits'] += 1
+                    return sql
+            self.misses += 1
             return None
         
         entry = self.cache[cache_key]
 
         # Check if expired
-        if datetime.now() - entry['timestamp'] > self.ttl:
+        now = time.monotonic()
+        if entry['expires_at'] < now:
             del self.cache[cache_key]
-            return
+            self.misses += 1
+            return None
         
         # Update hits and last accessed time
+        self.cache.move_to_end(cache_key)
+        self.hits += 1
         entry['hits'] += 1
-        entry['last_accessed'] = datetime.now()
+        entry['last_accessed'] = now
 
         return entry['sql']
     
-    def set(self, question: str, sql: str):
+    async def set(self, question: str, sql: str):
         """ store sql in cache """
         cache_key = self._get_cache_key(question)
+        self._insert(cache_key, question, sql, time.monotonic() + self.ttl_seconds)
+        if self.store is not None:
+            await asyncio.to_thread(
+                self.store.set, cache_key, question, sql, time.time() + self.ttl_seconds)
+
+    def _insert(self, cache_key: str, question: str, sql: str, expires_at: float):
+        """ Add an in-memory entry, evicting the least recently used """
+        now = time.monotonic()
 
         self.cache[cache_key]={
             "question": question,
             "sql":sql,
-            "timestamp":datetime.now(),
+            "expires_at":expires_at,
             "hits":0,
-            "last_accessed":datetime.now()
+            "last_accessed":now,
+            "result_sig":None,
+            "explanation":None
         }
+        self.cache.move_to_end(cache_key)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def get_explanation(self, question: str, result_sig: bytes) -> Optional[str]:
+        """ Get the cached explanation if it was made for the same results """
+        entry = self.cache.get(self._get_cache_key(question))
+        if entry is None or entry['result_sig'] != result_sig:
+            return None
+
+        return entry['explanation']
+
+    def set_explanation(self, question: str, result_sig: bytes, explanation: str):
+        """ Store the explanation next to the cached SQL """
+        entry = self.cache.get(self._get_cache_key(question))
+        if entry is None:
+            return
+
+        entry['result_sig'] = result_sig
+        entry['explanation'] = explanation
 
     def get_stats(self):
         """ Get cache stats """
@@ -61,15 +127,16 @@ class QueryCache:
         total_hits = sum(entry['hits'] for entry in self.cache.values())
 
         # Top queries
-        popular = sorted(self.cache.values(), key=lambda x: x['hits'], reverse=True)
+        popular = heapq.nlargest(5, self.cache.values(), key=lambda x: x['hits'])
+        lookups = self.hits + self.misses
 
         return {
             "total_cached_query": total_entries,
             "total_cache_hits":total_hits,
-            "cache_hit_rate": f"{total_hits / max(total_hits + total_entries, 1) * 100:.1f}%",
+            "cache_hit_rate": f"{self.hits / max(lookups, 1) * 100:.1f}%",
             "most_popular": [
                 {"question": q['question'], "hits": q['hits']}
-                for q in popular[:5]
+                for q in popular
             ]
 
         }
@@ -8,6 +8,9 @@ class QueryTemplates:
     
     def __init__(self):
         self.templates = self._init_templates()
+        # Compile once; match() runs on every analytics question
+        for template_data in self.templates.values():
+            template_data['compiled'] = [re.compile(p) for p in template_data['patterns']]
     
     def _init_templates(self) -> dict[str, dict]:
         """Initialize query templates"""
@@ -178,8 +181,8 @@ class QueryTemplates:
         question_lower = question.lower().strip()
         
         for template_name, template_data in self.templates.items():
-            for pattern in template_data['patterns']:
-                match = re.search(pattern, question_lower)
+            for pattern in template_data['compiled']:
+                match = pattern.search(question_lower)
                 
                 if match:
                     # Extract parameters from regex groups
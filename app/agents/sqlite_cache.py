@@ -0,0 +1,58 @@
+"""
+SQLite persistence for the analytics QueryCache.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+
+class SQLiteQueryStore:
+    """
+    Second-tier store behind QueryCache's in-memory entries.
+
+    Keeps question -> SQL rows with a wall-clock expiry so generated SQL
+    survives a restart. WAL with synchronous=NORMAL keeps a write to a local
+    page append rather than an fsync per insert. Calls block, so QueryCache
+    runs them in worker threads; a lock keeps them to one at a time on the
+    shared connection.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS qcache ("
+            "key TEXT PRIMARY KEY, question TEXT NOT NULL, sql TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        # Rows are otherwise only dropped when looked up after expiry
+        self._conn.execute("DELETE FROM qcache WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[Tuple[str, str, float]]:
+        """(question, sql, expires_at) for a live row, None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT question, sql, expires_at FROM qcache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[2] < time.time():
+                self._conn.execute("DELETE FROM qcache WHERE key = ?", (key,))
+                return None
+            return row
+
+    def set(self, key: str, question: str, sql: str, expires_at: float) -> None:
+        """Insert or replace a row; expires_at is wall-clock (time.time()) seconds."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO qcache (key, question, sql, expires_at) VALUES (?, ?, ?, ?)",
+                (key, question, sql, expires_at),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
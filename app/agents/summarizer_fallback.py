@@ -2,21 +2,37 @@
 Visit summarization agent with fallback system.
 """
 
+import asyncio
+import heapq
+import io
 import logging
+import textwrap
 from typing import Optional, List
 from app.agents.base_agent import FallbackAgent
+from app.agents.templates import (
+    DISCHARGE_PROMPT, HISTORY_CHUNK_PROMPT, HISTORY_COMPRESS_PROMPT, HISTORY_PROMPT,
+    VISIT_HISTORY, VISIT_SUMMARY_PROMPT)
 from app.models.visit import VisitResponse
 from app.models.patient import PatientResponse
 
 logger = logging.getLogger(__name__)
 
 
-class VisitSummarizerAgent:
-    """Agent for summarizing patient visit data with AI provider fallback."""
+# Histories longer than this are summarized in chunks first (map-reduce),
+# so no single prompt carries every visit
+_MAX_SINGLE_PROMPT_VISITS = 20
+_HISTORY_CHUNK_VISITS = 10
+# Ceiling on concurrent chunk summaries for one history
+_CHUNK_CONCURRENCY = 10
+# Combined chunk summaries estimated over this many tokens are rewritten to
+# _HISTORY_COMPRESSED_TOKENS before the final call (rough 4 chars/token)
+_CHARS_PER_TOKEN = 4
+_HISTORY_SUMMARY_TOKEN_BUDGET = 1000
+_HISTORY_COMPRESSED_TOKENS = 800
 
-    def __init__(self):
-        """Initialize the visit summarizer agent."""
-        system_prompt = """
+
+# Dedented so source indentation isn't sent (and billed) as prompt tokens
+_SYSTEM_PROMPT = textwrap.dedent("""
         You are a medical documentation AI that helps healthcare professionals summarize patient visits.
         
         Your role:
@@ -41,10 +57,24 @@ class VisitSummarizerAgent:
         - Treatment Plan
         - Follow-up Requirements
         - Clinical Notes & Observations
-        """
+        """).strip()
+
 
-        self.agent = FallbackAgent(system_prompt)
-        logger.info("Visit Summarizer Agent initialized with fallback system")
+class SummarizationError(Exception):
+    """Raised when a summary could not be generated; chained to the cause."""
+
+
+class VisitSummarizerAgent:
+    """Agent for summarizing patient visit data with AI provider fallback."""
+
+    def __init__(self):
+        """Initialize the visit summarizer agent."""
+        self.agent = FallbackAgent(_SYSTEM_PROMPT)
+        # The provider set is fixed once the agents are built, so it is
+        # logged here rather than on every summarize call
+        logger.info(
+            f"Visit Summarizer Agent initialized with fallback system: "
+            f"{self.agent.get_available_providers()}")
 
     async def summarize_visit(
         self,
@@ -62,55 +92,7 @@ class VisitSummarizerAgent:
             AI-generated visit summary
         """
         try:
-            # Prepare visit information
-            visit_info = f"""
-            Visit Information:
-            - Visit ID: {visit.id}
-            - Date: {visit.visit_date}
-            - Type: {visit.visit_type}
-            - Chief Complaint: {visit.chief_complaint}
-            - Diagnosis: {visit.diagnosis}
-            """
-
-            if visit.treatment_plan:
-                visit_info += f"- Treatment Plan: {visit.treatment_plan}\n"
-
-            if visit.doctor_notes:
-                visit_info += f"- Clinical Notes: {visit.doctor_notes}\n"
-
-            # Add patient context if available
-            patient_info = ""
-            if patient:
-                patient_info = f"""
-                Patient Information:
-                - Name: {patient.first_name} {patient.last_name}
-                - ID: {patient.id}
-                - DOB: {patient.date_of_birth}
-                - Gender: {patient.gender}
-                """
-                if patient.medical_history:
-                    patient_info += f"- Medical History: {patient.medical_history}\n"
-                if patient.emergency_contact:
-                    patient_info += f"- Emergency Contact: {patient.emergency_contact}\n"
-
-            full_input = f"""
-            {patient_info}
-            
-            {visit_info}
-            
-            Please create a comprehensive medical visit summary that would be useful for:
-            1. Other healthcare providers reviewing this case
-            2. Insurance documentation
-            3. Medical record continuity
-            4. Follow-up planning
-            
-            Format the summary professionally and include all relevant clinical details.
-            """
-
-            # Get available providers for logging
-            available_providers = self.agent.get_available_providers()
-            logger.info(
-                f"Available AI providers for summarization: {available_providers}")
+            full_input = VISIT_SUMMARY_PROMPT.render(visit=visit, patient=patient)
 
             # Run the query with fallback
             response = await self.agent.run_async(full_input)
@@ -120,7 +102,20 @@ class VisitSummarizerAgent:
 
         except Exception as e:
             logger.error(f"❌ Visit summarization failed: {e}")
-            raise Exception(f"Visit summarization failed: {str(e)}")
+            raise SummarizationError(f"Visit summarization failed: {e}") from e
+
+    async def precompute_summary(self, visit: VisitResponse) -> None:
+        """
+        Summarize a visit ahead of time to warm the response cache.
+
+        Meant to run as a background task after a visit is saved: the prompt
+        is the one /agents/summarize renders for the same visit, so a later
+        request for it is answered from cache. Failures are only logged.
+        """
+        try:
+            await self.summarize_visit(visit)
+        except Exception as e:
+            logger.warning(f"Visit summary precompute failed for visit {visit.id}: {e}")
 
     async def summarize_visit_stream(
         self,
@@ -138,55 +133,7 @@ class VisitSummarizerAgent:
             Text chunks of the AI-generated visit summary
         """
         try:
-            # Prepare visit information (same as non-streaming version)
-            visit_info = f"""
-            Visit Information:
-            - Visit ID: {visit.id}
-            - Date: {visit.visit_date}
-            - Type: {visit.visit_type}
-            - Chief Complaint: {visit.chief_complaint}
-            - Diagnosis: {visit.diagnosis}
-            """
-
-            if visit.treatment_plan:
-                visit_info += f"- Treatment Plan: {visit.treatment_plan}\n"
-
-            if visit.doctor_notes:
-                visit_info += f"- Clinical Notes: {visit.doctor_notes}\n"
-
-            # Add patient context if available
-            patient_info = ""
-            if patient:
-                patient_info = f"""
-                Patient Information:
-                - Name: {patient.first_name} {patient.last_name}
-                - ID: {patient.id}
-                - DOB: {patient.date_of_birth}
-                - Gender: {patient.gender}
-                """
-                if patient.medical_history:
-                    patient_info += f"- Medical History: {patient.medical_history}\n"
-                if patient.emergency_contact:
-                    patient_info += f"- Emergency Contact: {patient.emergency_contact}\n"
-
-            full_input = f"""
-            {patient_info}
-            
-            {visit_info}
-            
-            Please create a comprehensive medical visit summary that would be useful for:
-            1. Other healthcare providers reviewing this case
-            2. Insurance documentation
-            3. Medical record continuity
-            4. Follow-up planning
-            
-            Format the summary professionally and include all relevant clinical details.
-            """
-
-            # Get available providers for logging
-            available_providers = self.agent.get_available_providers()
-            logger.info(
-                f"Available AI providers for streaming summarization: {available_providers}")
+            full_input = VISIT_SUMMARY_PROMPT.render(visit=visit, patient=patient)
 
             # Stream the response with fallback
             async for chunk in self.agent.run_stream(full_input):
@@ -196,7 +143,7 @@ class VisitSummarizerAgent:
 
         except Exception as e:
             logger.error(f"❌ Visit summarization streaming failed: {e}")
-            raise Exception(f"Visit summarization streaming failed: {str(e)}")
+            raise SummarizationError(f"Visit summarization streaming failed: {e}") from e
 
     async def summarize_patient_history(
         self,
@@ -216,55 +163,21 @@ class VisitSummarizerAgent:
             AI-generated patient history summary
         """
         try:
-            # Sort visits by date (most recent first)
-            sorted_visits = sorted(
-                visits, key=lambda v: v.visit_date, reverse=True)
-
+            # Most recent first; with a limit only the newest `limit` visits
+            # are selected (a heap pass) instead of sorting the whole history
             if limit:
-                sorted_visits = sorted_visits[:limit]
-
-            # Prepare patient information
-            patient_info = f"""
-            Patient: {patient.first_name} {patient.last_name} (ID: {patient.id})
-            DOB: {patient.date_of_birth}
-            Gender: {patient.gender}
-            """
-
-            if patient.medical_history:
-                patient_info += f"Medical History: {patient.medical_history}\n"
+                sorted_visits = heapq.nlargest(limit, visits, key=lambda v: v.visit_date)
+            else:
+                sorted_visits = sorted(
+                    visits, key=lambda v: v.visit_date, reverse=True)
 
             # Prepare visit history
-            visit_history = "Visit History (Most Recent First):\n\n"
-            for i, visit in enumerate(sorted_visits, 1):
-                visit_history += f"{i}. Visit on {visit.visit_date}:\n"
-                visit_history += f"   Type: {visit.visit_type}\n"
-                visit_history += f"   Chief Complaint: {visit.chief_complaint}\n"
-                visit_history += f"   Diagnosis: {visit.diagnosis}\n"
-
-                if visit.treatment_plan:
-                    visit_history += f"   Treatment: {visit.treatment_plan}\n"
-
-                if visit.doctor_notes:
-                    visit_history += f"   Notes: {visit.doctor_notes}\n"
-
-                visit_history += "\n"
-
-            full_input = f"""
-            {patient_info}
-            
-            {visit_history}
-            
-            Please create a comprehensive patient history summary that includes:
-            1. Patient overview and demographics
-            2. Medical history trends and patterns
-            3. Recurring issues or chronic conditions
-            4. Treatment effectiveness and outcomes
-            5. Current health status and ongoing concerns
-            6. Recommendations for future care
-            
-            This summary should be useful for healthcare providers who need to quickly understand
-            this patient's medical journey and current status.
-            """
+            if len(sorted_visits) > _MAX_SINGLE_PROMPT_VISITS:
+                visit_history = await self._summarize_visit_chunks(patient, sorted_visits)
+            else:
+                visit_history = VISIT_HISTORY.render(visits=sorted_visits, start=1)
+
+            full_input = HISTORY_PROMPT.render(patient=patient, visit_history=visit_history)
 
             # Run the query with fallback
             response = await self.agent.run_async(full_input)
@@ -275,7 +188,47 @@ class VisitSummarizerAgent:
 
         except Exception as e:
             logger.error(f"❌ Patient history summarization failed: {e}")
-            raise Exception(f"Patient history summarization failed: {str(e)}")
+            raise SummarizationError(f"Patient history summarization failed: {e}") from e
+
+    async def _summarize_visit_chunks(
+        self,
+        patient: PatientResponse,
+        visits: List[VisitResponse]
+    ) -> str:
+        """
+        Summarize a long, newest-first history chunk by chunk, concurrently.
+
+        Returns the partial summaries in order, ready to stand in for the
+        raw visit list in the overall history prompt. If together they run
+        over the token budget, they are first rewritten into one shorter
+        summary so the final prompt stays bounded however long the history.
+        """
+        sem = asyncio.Semaphore(_CHUNK_CONCURRENCY)
+
+        async def _one(start: int, chunk: List[VisitResponse]) -> str:
+            prompt = HISTORY_CHUNK_PROMPT.render(patient=patient, visits=chunk, start=start)
+            async with sem:
+                return await self.agent.run_async(prompt)
+
+        starts = range(0, len(visits), _HISTORY_CHUNK_VISITS)
+        summaries = await asyncio.gather(*[
+            _one(i + 1, visits[i:i + _HISTORY_CHUNK_VISITS]) for i in starts])
+
+        buf = io.StringIO()
+        buf.write("Visit History Summaries (Most Recent First):\n\n")
+        for i, summary in zip(starts, summaries):
+            chunk = visits[i:i + _HISTORY_CHUNK_VISITS]
+            buf.write(f"Visits {i + 1}-{i + len(chunk)} "
+                      f"({chunk[-1].visit_date} to {chunk[0].visit_date}):\n")
+            buf.write(summary.strip())
+            buf.write("\n\n")
+        summaries_text = buf.getvalue()
+
+        if len(summaries_text) // _CHARS_PER_TOKEN <= _HISTORY_SUMMARY_TOKEN_BUDGET:
+            return summaries_text
+        compressed = await self.agent.run_async(HISTORY_COMPRESS_PROMPT.render(
+            summaries=summaries_text, max_tokens=_HISTORY_COMPRESSED_TOKENS))
+        return "Visit History Summary (Most Recent First):\n\n" + compressed.strip() + "\n"
 
     async def create_discharge_summary(
         self,
@@ -293,29 +246,7 @@ class VisitSummarizerAgent:
             AI-generated discharge summary
         """
         try:
-            full_input = f"""
-            Patient: {patient.first_name} {patient.last_name} (ID: {patient.id})
-            DOB: {patient.date_of_birth}, Gender: {patient.gender}
-            
-            Visit Details:
-            - Date: {visit.visit_date}
-            - Type: {visit.visit_type}
-            - Chief Complaint: {visit.chief_complaint}
-            - Diagnosis: {visit.diagnosis}
-            - Treatment: {visit.treatment_plan or 'Not specified'}
-            - Notes: {visit.doctor_notes or 'No additional notes'}
-            
-            Please create a formal discharge summary including:
-            1. Admission reason and chief complaint
-            2. Clinical findings and assessment
-            3. Treatments provided
-            4. Discharge instructions
-            5. Follow-up recommendations
-            6. Medications prescribed (if mentioned)
-            7. Warning signs to watch for
-            
-            Format this as a professional medical discharge summary.
-            """
+            full_input = DISCHARGE_PROMPT.render(visit=visit, patient=patient)
 
             response = await self.agent.run_async(full_input)
 
@@ -324,13 +255,14 @@ class VisitSummarizerAgent:
 
         except Exception as e:
             logger.error(f"❌ Discharge summary creation failed: {e}")
-            raise Exception(f"Discharge summary creation failed: {str(e)}")
+            raise SummarizationError(f"Discharge summary creation failed: {e}") from e
 
     def get_agent_status(self) -> dict:
         """Get the status of all available AI providers."""
         return {
             "available_providers": self.agent.get_available_providers(),
-            "provider_status": self.agent.get_status()
+            "provider_status": self.agent.get_status(),
+            "breaker_states": self.agent.get_breaker_states()
         }
 
     def get_fallback_info(self) -> dict:
@@ -341,6 +273,7 @@ class VisitSummarizerAgent:
             "provider_order": ["xai", "openai", "anthropic"],
             "available_providers": status["available_providers"],
             "provider_status": status["provider_status"],
+            "breaker_states": status["breaker_states"],
             "total_available": len(status["available_providers"])
         }
 
@@ -0,0 +1,282 @@
+"""
+Prompt templates for the Q&A and visit summarizer agents.
+"""
+
+from typing import Any, Callable
+import jinja2
+import orjson
+from cachetools import LRUCache
+from app.services.formatting_service import medical_formatter
+
+# Attribute lookups in Jinja fall back to item lookups, so the same template
+# renders PatientResponse/VisitResponse objects and plain dicts alike.
+_QA_CONTEXT = """\
+{% if patients %}
+Patient Information:
+{% for patient in patients %}
+- Patient {{ patient.first_name|default('Unknown') }} {{ patient.last_name|default('Unknown') }} (DOB: {{ patient.date_of_birth|default('Unknown') }})
+{% if patient.medical_history %}
+  Medical History: {{ patient.medical_history }}
+{% endif %}
+{% if patient.allergies %}
+  Allergies: {{ patient.allergies }}
+{% endif %}
+{% if patient.current_medications %}
+  Current Medications: {{ patient.current_medications }}
+{% endif %}
+{% endfor %}
+{% endif %}
+{% if visits %}
+Visit Information:
+{% for visit in visits %}
+- Visit {{ visit.visit_date|default('Unknown') }} ({{ visit.visit_type|default('Unknown') }})
+  Chief Complaint: {{ visit.chief_complaint|default('N/A') }}
+  Diagnosis: {{ visit.diagnosis|default('N/A') }}
+  Treatment: {{ visit.treatment_plan|default('N/A') }}
+{% if visit.vital_signs %}
+  {{ visit.vital_signs|vital_signs_table }}
+{% endif %}
+{% if visit.lab_results %}
+  {{ visit.lab_results|lab_results_table }}
+{% endif %}
+{% if visit.doctor_notes %}
+  Notes: {{ visit.doctor_notes }}
+{% endif %}
+{% if visit.duration_minutes %}
+  Duration: {{ visit.duration_minutes }} minutes
+{% endif %}
+{% endfor %}
+{% if omitted_visits %}
+(Older visits omitted: {{ omitted_visits }})
+{% endif %}
+{% endif %}
+"""
+
+# Shared by the single- and multi-question prompts
+_QA_GUIDANCE = """\
+IMPORTANT: When vital signs or lab results are provided as Markdown tables in the context above, \
+you MUST reproduce those exact tables in your response. Do not summarize table data into sentences. \
+Copy the table format exactly as shown. \
+Cite the visit date once at the beginning of your answer, not after every line. \
+Be specific about which information you're referencing and provide appropriate sources."""
+
+_QA_PROMPT = """\
+Question: {{ question }}
+{% include "qa_context" %}
+
+Please answer the question based on the provided medical data. \
+""" + _QA_GUIDANCE
+
+# Used when a question comes without patient or visit records; the table and
+# citation guidance has nothing to apply to, so it is left out
+_QA_BARE_PROMPT = """\
+Question: {{ question }}
+Patient ID: {{ patient_id or '-' }}
+Visit ID: {{ visit_id or '-' }}
+
+No patient or visit records were provided with this question. \
+Say so if the answer depends on them."""
+
+# Several questions over the same context in one call; the context is sent
+# once and each answer is headed by a numbered marker the agent splits on
+_QA_QUESTIONS_PROMPT = """\
+Questions:
+{% for question in questions %}
+{{ loop.index }}. {{ question }}
+{% endfor %}
+{% include "qa_context" %}
+
+Please answer each numbered question based on the provided medical data. \
+Start each answer with a line of the form "### Answer <n>", where <n> is the question number, \
+and answer every question in order. \
+""" + _QA_GUIDANCE
+
+# Summarizer prompts open with their fixed task instructions and put the
+# patient/visit data last, so consecutive requests share a byte-identical
+# prefix (system prompt + task) that providers can serve from prefix cache
+_VISIT_SUMMARY_PROMPT = """\
+Please create a comprehensive medical visit summary that would be useful for:
+1. Other healthcare providers reviewing this case
+2. Insurance documentation
+3. Medical record continuity
+4. Follow-up planning
+
+Format the summary professionally and include all relevant clinical details.
+
+{% if patient %}
+Patient Information:
+- Name: {{ patient.first_name }} {{ patient.last_name }}
+- ID: {{ patient.id }}
+- DOB: {{ patient.date_of_birth }}
+- Gender: {{ patient.gender }}
+{% if patient.medical_history %}
+- Medical History: {{ patient.medical_history }}
+{% endif %}
+{% if patient.emergency_contact %}
+- Emergency Contact: {{ patient.emergency_contact }}
+{% endif %}
+
+{% endif %}
+Visit Information:
+- Visit ID: {{ visit.id }}
+- Date: {{ visit.visit_date }}
+- Type: {{ visit.visit_type }}
+- Chief Complaint: {{ visit.chief_complaint }}
+- Diagnosis: {{ visit.diagnosis }}
+{% if visit.treatment_plan %}
+- Treatment Plan: {{ visit.treatment_plan }}
+{% endif %}
+{% if visit.doctor_notes %}
+- Clinical Notes: {{ visit.doctor_notes }}
+{% endif %}
+"""
+
+# Numbered newest-first visit entries; `start` numbers the first one
+_VISIT_LIST = """\
+{% for visit in visits %}
+{{ start + loop.index0 }}. Visit on {{ visit.visit_date }}:
+{{ visit.history_entry }}
+{% endfor %}
+"""
+
+_VISIT_HISTORY = """\
+Visit History (Most Recent First):
+
+{% include "visit_list" %}"""
+
+_HISTORY_CHUNK_PROMPT = """\
+Summarize the visits below in one short paragraph for a later overall \
+history summary. Keep visit dates, diagnoses, treatments, and any \
+changes or concerns.
+
+Patient: {{ patient.first_name }} {{ patient.last_name }}
+
+{% include "visit_list" %}"""
+
+_HISTORY_COMPRESS_PROMPT = """\
+Rewrite the visit history summaries below in at most {{ max_tokens }} tokens. \
+Keep every diagnosis, medication, allergy, and visit date range; drop \
+repetition and routine findings.
+
+{{ summaries }}"""
+
+# visit_history is either the rendered visit list or, for long histories,
+# the chunk summaries that stand in for it
+_HISTORY_PROMPT = """\
+Please create a comprehensive patient history summary that includes:
+1. Patient overview and demographics
+2. Medical history trends and patterns
+3. Recurring issues or chronic conditions
+4. Treatment effectiveness and outcomes
+5. Current health status and ongoing concerns
+6. Recommendations for future care
+
+This summary should be useful for healthcare providers who need to quickly understand
+this patient's medical journey and current status.
+
+Patient: {{ patient.first_name }} {{ patient.last_name }} (ID: {{ patient.id }})
+DOB: {{ patient.date_of_birth }}
+Gender: {{ patient.gender }}
+{% if patient.medical_history %}
+Medical History: {{ patient.medical_history }}
+{% endif %}
+
+{{ visit_history }}"""
+
+_DISCHARGE_PROMPT = """\
+Please create a formal discharge summary including:
+1. Admission reason and chief complaint
+2. Clinical findings and assessment
+3. Treatments provided
+4. Discharge instructions
+5. Follow-up recommendations
+6. Medications prescribed (if mentioned)
+7. Warning signs to watch for
+
+Format this as a professional medical discharge summary.
+
+Patient: {{ patient.first_name }} {{ patient.last_name }} (ID: {{ patient.id }})
+DOB: {{ patient.date_of_birth }}, Gender: {{ patient.gender }}
+
+Visit Details:
+- Date: {{ visit.visit_date }}
+- Type: {{ visit.visit_type }}
+- Chief Complaint: {{ visit.chief_complaint }}
+- Diagnosis: {{ visit.diagnosis }}
+- Treatment: {{ visit.treatment_plan or 'Not specified' }}
+- Notes: {{ visit.doctor_notes or 'No additional notes' }}"""
+
+_INSIGHTS_QUESTION = (
+    "Please analyze the health trends and patterns for patient "
+    "{{ patient.first_name }} {{ patient.last_name }} based on their visit history. "
+    "Provide insights about their overall health trajectory, any concerning patterns, "
+    "and recommendations for continued care."
+)
+
+_COMPARE_QUESTION = (
+    "Please compare these two visits and identify key changes, improvements, or concerning "
+    "developments between visit {{ visit1.visit_date }} and visit {{ visit2.visit_date }}."
+)
+
+_ENV = jinja2.Environment(
+    loader=jinja2.DictLoader({
+        "qa_context": _QA_CONTEXT,
+        "qa_prompt": _QA_PROMPT,
+        "qa_bare": _QA_BARE_PROMPT,
+        "qa_questions": _QA_QUESTIONS_PROMPT,
+        "insights": _INSIGHTS_QUESTION,
+        "compare": _COMPARE_QUESTION,
+        "visit_summary": _VISIT_SUMMARY_PROMPT,
+        "visit_list": _VISIT_LIST,
+        "visit_history": _VISIT_HISTORY,
+        "history_chunk": _HISTORY_CHUNK_PROMPT,
+        "history_compress": _HISTORY_COMPRESS_PROMPT,
+        "history": _HISTORY_PROMPT,
+        "discharge": _DISCHARGE_PROMPT,
+    }),
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+
+
+def _memoized(format_markdown: Callable[[Any], str]) -> Callable[[Any], str]:
+    """
+    Cache a formatter's Markdown by the JSON of its input.
+
+    The same visit's vitals and labs are formatted again for every question
+    about that patient. A JSON string is its own key; parsed data is keyed
+    by its (order-preserving) orjson dump. Anything orjson can't serialize
+    is formatted uncached.
+    """
+    cache: LRUCache = LRUCache(maxsize=4096)
+
+    def format_value(value: Any) -> str:
+        try:
+            key = value if isinstance(value, str) else orjson.dumps(value)
+        except TypeError:
+            return format_markdown(value)
+        try:
+            return cache[key]
+        except KeyError:
+            markdown = cache[key] = format_markdown(value)
+            return markdown
+
+    return format_value
+
+
+_ENV.filters["vital_signs_table"] = _memoized(medical_formatter.format_vital_signs_markdown)
+_ENV.filters["lab_results_table"] = _memoized(medical_formatter.format_lab_results_markdown)
+
+# Compiled once at import; render() reuses the compiled bytecode
+QA_PROMPT = _ENV.get_template("qa_prompt")
+QA_BARE_PROMPT = _ENV.get_template("qa_bare")
+QA_QUESTIONS_PROMPT = _ENV.get_template("qa_questions")
+INSIGHTS_QUESTION = _ENV.get_template("insights")
+COMPARE_QUESTION = _ENV.get_template("compare")
+VISIT_SUMMARY_PROMPT = _ENV.get_template("visit_summary")
+VISIT_HISTORY = _ENV.get_template("visit_history")
+HISTORY_CHUNK_PROMPT = _ENV.get_template("history_chunk")
+HISTORY_COMPRESS_PROMPT = _ENV.get_template("history_compress")
+HISTORY_PROMPT = _ENV.get_template("history")
+DISCHARGE_PROMPT = _ENV.get_template("discharge")
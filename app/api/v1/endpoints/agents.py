@@ -2,24 +2,28 @@
 AI agents API endpoints for summarization and Q&A.
 """
 
-from typing import List, Optional
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.session import get_db
-from app.utils.streaming_utils import stream_response, stream_response_with_mermaid_buffering
+from app.utils.streaming_utils import (
+    stream_response, stream_response_with_mermaid_buffering, with_heartbeat)
 from app.models.schemas import (
     SummarizeVisitRequest,
     SummarizeVisitResponse,
     QuestionAnswerRequest,
     QuestionAnswerResponse,
+    BatchQuestionAnswerRequest,
+    BatchQuestionAnswerResponse,
     HealthSummaryRequest,
     HealthSummaryResponse,
     ErrorResponse
 )
 from app.services.visit_service import VisitService
 from app.services.patient_service import PatientService
-from app.agents.summarizer_fallback import visit_summarizer
+from app.agents.summarizer_fallback import SummarizationError, visit_summarizer
 from app.agents.qa_agent import medical_qa_agent
 from datetime import datetime
 import structlog
@@ -28,6 +32,67 @@ logger = structlog.get_logger()
 router = APIRouter()
 
 
+async def _fetch_concurrently(
+    db: AsyncSession,
+    *fetches: Callable[[AsyncSession], Awaitable[Any]]
+) -> List[Any]:
+    """
+    Run independent reads concurrently and return their results in order.
+
+    An AsyncSession can't run two statements at once, so each fetch gets its
+    own short-lived session on the request session's engine.
+    """
+    async def run(fetch):
+        async with AsyncSession(db.bind, expire_on_commit=False) as session:
+            return await fetch(session)
+
+    return await asyncio.gather(*(run(fetch) for fetch in fetches))
+
+
+async def _load_qa_context(request: QuestionAnswerRequest, db: AsyncSession) -> Tuple[list, list]:
+    """Load the patients and visits a question should be answered from."""
+    visit_service = VisitService(db)
+    patient_service = PatientService(db)
+
+    patients = []
+    visits = []
+
+    # Get relevant data based on context; the patient, their visits and the
+    # requested visit don't depend on each other, so they are read together
+    visit = None
+    if request.patient_id:
+        fetches = [
+            lambda s: PatientService(s).get_patient_by_id(request.patient_id),
+            lambda s: PatientService(s).get_patient_visits(request.patient_id),
+        ]
+        if request.visit_id:
+            fetches.append(lambda s: VisitService(s).get_visit_by_id(request.visit_id))
+        patient, patient_visits, *requested = await _fetch_concurrently(db, *fetches)
+        if patient:
+            patients = [patient]
+            visits = patient_visits
+        visit = requested[0] if requested else None
+    elif request.visit_id:
+        visit = await visit_service.get_visit_by_id(request.visit_id)
+
+    if visit:
+        visits = [visit]
+        if not patients:
+            patient = await patient_service.get_patient_by_id(visit.patient_id)
+            if patient:
+                patients = [patient]
+
+    if not request.patient_id and not request.visit_id and request.context_type == "all":
+        # Get recent data for general questions
+        patients, visits = await _fetch_concurrently(
+            db,
+            lambda s: PatientService(s).get_patients(skip=0, limit=50),
+            lambda s: VisitService(s).get_visits(skip=0, limit=100),
+        )
+
+    return patients, visits
+
+
 @router.post("/summarize", response_model=SummarizeVisitResponse)
 async def summarize_visit_endpoint(
     request: SummarizeVisitRequest,
@@ -51,13 +116,8 @@ async def summarize_visit_endpoint(
 
         # Get patient information if requested
         patient = None
-        previous_visits = None
-
         if request.include_patient_history:
             patient = await patient_service.get_patient_by_id(visit.patient_id)
-            previous_visits = await patient_service.get_patient_visits(
-                patient.patient_id, skip=0, limit=10
-            )
 
         # Generate summary using AI fallback system (X.AI -> OpenAI -> Anthropic)
         summary_result = await visit_summarizer.summarize_visit(
@@ -84,6 +144,14 @@ async def summarize_visit_endpoint(
             generated_at=datetime.utcnow()
         )
 
+    except SummarizationError as e:
+        # The AI providers failed, not the request; clients may retry
+        logger.error("Error summarizing visit",
+                     visit_id=request.id, error=str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Error generating visit summary: {str(e)}"
+        )
     except Exception as e:
         logger.error("Error summarizing visit",
                      visit_id=request.id, error=str(e))
@@ -105,32 +173,8 @@ async def ask_question_endpoint(
 
     print("Inside Asking question...", db, request.question)
     try:
-        visit_service = VisitService(db)
-        patient_service = PatientService(db)
-
-        patients = []
-        visits = []
-
-        # Get relevant data based on context
-        if request.patient_id:
-            patient = await patient_service.get_patient_by_id(request.patient_id)
-            if patient:
-                patients = [patient]
-                visits = await patient_service.get_patient_visits(request.patient_id)
+        patients, visits = await _load_qa_context(request, db)
 
-        if request.visit_id:
-            visit = await visit_service.get_visit_by_id(request.visit_id)
-            if visit:
-                visits = [visit]
-                if not patients:
-                    patient = await patient_service.get_patient_by_id(visit.patient_id)
-                    if patient:
-                        patients = [patient]
-
-        if not request.patient_id and not request.visit_id and request.context_type == "all":
-            # Get recent data for general questions
-            patients = await patient_service.get_patients(skip=0, limit=50)
-            visits = await visit_service.get_visits(skip=0, limit=100)
         # Generate answer using AI fallback system (X.AI -> OpenAI -> Anthropic)
         qa_result = await medical_qa_agent.answer_question(
             question=request.question,
@@ -169,6 +213,66 @@ async def ask_question_endpoint(
         )
 
 
+@router.post("/ask/batch", response_model=BatchQuestionAnswerResponse)
+async def ask_questions_batch_endpoint(
+    request: BatchQuestionAnswerRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Answer several questions about patient data concurrently.
+    Answers are returned in the order the questions were sent.
+    """
+    try:
+        # Context is loaded one question at a time on the shared session
+        # (AsyncSession is not safe for concurrent use); questions with the
+        # same scope reuse it. Only the provider calls run concurrently.
+        contexts: Dict[tuple, dict] = {}
+        items = []
+        for item in request.questions:
+            scope = (item.patient_id, item.visit_id, item.context_type)
+            if scope not in contexts:
+                patients, visits = await _load_qa_context(item, db)
+                contexts[scope] = {
+                    "patient_id": item.patient_id,
+                    "visit_id": item.visit_id,
+                    "patients": patients,
+                    "visits": visits,
+                }
+            items.append((item.question, contexts[scope]))
+
+        answers = await medical_qa_agent.batch_answer(items)
+
+        background_tasks.add_task(
+            logger.info,
+            "Batch questions answered",
+            count=len(items),
+            scopes=len(contexts)
+        )
+
+        generated_at = datetime.utcnow()
+        return BatchQuestionAnswerResponse(answers=[
+            QuestionAnswerResponse(
+                question=item.question,
+                answer=answer,
+                sources=[{"type": "ai_analysis",
+                          "content": "AI-generated via fallback system"}],
+                confidence_score=0.8,  # Default confidence
+                context_used="Patient and visit data",
+                generated_at=generated_at
+            )
+            for item, answer in zip(request.questions, answers)
+        ])
+
+    except Exception as e:
+        logger.error("Error answering batch questions",
+                     count=len(request.questions), error=str(e))
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating answers: {str(e)}"
+        )
+
+
 @router.post("/health-summary", response_model=HealthSummaryResponse)
 async def get_health_summary_endpoint(
     request: HealthSummaryRequest,
@@ -179,23 +283,22 @@ async def get_health_summary_endpoint(
     Generate a comprehensive health summary for a patient.
     """
     try:
-        patient_service = PatientService(db)
-
-        # Get patient information
-        patient = await patient_service.get_patient_by_id(request.patient_id)
+        # Get patient information and recent visits together
+        patient, visits = await _fetch_concurrently(
+            db,
+            lambda s: PatientService(s).get_patient_by_id(request.patient_id),
+            lambda s: PatientService(s).get_patient_visits(
+                request.patient_id,
+                skip=0,
+                limit=request.include_recent_visits
+            ),
+        )
         if not patient:
             raise HTTPException(
                 status_code=404,
                 detail=f"Patient with ID {request.patient_id} not found"
             )
 
-        # Get recent visits
-        visits = await patient_service.get_patient_visits(
-            request.patient_id,
-            skip=0,
-            limit=request.include_recent_visits
-        )
-
         # Generate insights using AI fallback system (X.AI -> OpenAI -> Anthropic)
         insights = await medical_qa_agent.answer_question(
             question=f"Provide a comprehensive health summary for patient {patient.first_name} {patient.last_name}",
@@ -251,11 +354,12 @@ async def compare_visits_endpoint(
     Compare two visits to identify changes and trends.
     """
     try:
-        visit_service = VisitService(db)
-
         # Get both visits
-        visit1 = await visit_service.get_visit_by_visit_id(visit_id_1)
-        visit2 = await visit_service.get_visit_by_visit_id(visit_id_2)
+        visit1, visit2 = await _fetch_concurrently(
+            db,
+            lambda s: VisitService(s).get_visit_by_visit_id(visit_id_1),
+            lambda s: VisitService(s).get_visit_by_visit_id(visit_id_2),
+        )
 
         if not visit1:
             raise HTTPException(
@@ -347,7 +451,7 @@ async def summarize_visit_stream_endpoint(
             yield f"data: {{\"type\": \"error\", \"error\": \"{str(e)}\"}}\n\n"
 
     return StreamingResponse(
-        generate_stream(),
+        with_heartbeat(generate_stream()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -369,32 +473,8 @@ async def ask_question_stream_endpoint(
     """
     async def generate_stream():
         try:
-            visit_service = VisitService(db)
-            patient_service = PatientService(db)
+            patients, visits = await _load_qa_context(request, db)
 
-            patients = []
-            visits = []
-
-            # Get relevant data based on context
-            if request.patient_id:
-                patient = await patient_service.get_patient_by_id(request.patient_id)
-                if patient:
-                    patients = [patient]
-                    visits = await patient_service.get_patient_visits(request.patient_id)
-
-            if request.visit_id:
-                visit = await visit_service.get_visit_by_id(request.visit_id)
-                if visit:
-                    visits = [visit]
-                    if not patients:
-                        patient = await patient_service.get_patient_by_id(visit.patient_id)
-                        if patient:
-                            patients = [patient]
-
-            if not request.patient_id and not request.visit_id and request.context_type == "all":
-                # Get recent data for general questions
-                patients = await patient_service.get_patients(skip=0, limit=50)
-                visits = await visit_service.get_visits(skip=0, limit=100)
 
             # Stream answer using AI fallback system
             content_stream = medical_qa_agent.answer_question_stream(
@@ -421,7 +501,7 @@ async def ask_question_stream_endpoint(
             yield f"data: {{\"type\": \"error\", \"error\": \"{str(e)}\"}}\n\n"
 
     return StreamingResponse(
-        generate_stream(),
+        with_heartbeat(generate_stream()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
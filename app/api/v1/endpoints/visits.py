@@ -4,9 +4,11 @@ Visit management API endpoints with authentication and HIPAA compliance.
 
 import logging
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.agents.summarizer_fallback import visit_summarizer
+from app.config import settings
 from app.database.session import get_db
 from app.models.visit import VisitCreate, VisitUpdate, VisitResponse, VisitSummary
 from app.models.user import User, UserRole
@@ -47,6 +49,7 @@ async def list_visits(
 @router.post("/", response_model=VisitResponse, status_code=201)
 async def create_visit(
     visit: VisitCreate,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role(UserRole.ADMIN, UserRole.DOCTOR))
 ):
@@ -71,6 +74,8 @@ async def create_visit(
     created_visit = await visit_service.create_visit(visit)
     logger.info("Visit created: ID %s by user %s",
                 created_visit.visit_id, current_user.username)
+    if settings.PRECOMPUTE_VISIT_SUMMARIES:
+        background_tasks.add_task(visit_summarizer.precompute_summary, created_visit)
     return created_visit
 
 
@@ -107,6 +112,7 @@ async def get_visit_by_db_id(
 async def update_visit(
     db_id: int,
     visit_update: VisitUpdate,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role(UserRole.ADMIN, UserRole.DOCTOR))
 ):
@@ -133,6 +139,8 @@ async def update_visit(
     updated_visit = await visit_service.update_visit(db_id, visit_update)
     logger.info("Visit updated: ID %d by user %s",
                 db_id, current_user.username)
+    if settings.PRECOMPUTE_VISIT_SUMMARIES:
+        background_tasks.add_task(visit_summarizer.precompute_summary, updated_visit)
     return updated_visit
 
 
@@ -78,6 +78,10 @@ class Settings(BaseSettings):
     
     TEST_DATABASE_URL: str = os.getenv("TEST_DATABASE_URL")
 
+    # Set when an external pooler (PgBouncer in transaction mode) fronts the
+    # database, so the app doesn't hold its own idle connections
+    DATABASE_NULLPOOL: bool = False
+
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(
@@ -89,6 +93,22 @@ class Settings(BaseSettings):
     XAI_API_KEY: str = os.getenv("XAI_API_KEY", "")
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
     GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
+    # Latency SLO: a provider call (or a stream's first text) slower than
+    # this is raced against the next provider, once per run (0 = off)
+    AI_HEDGE_DELAY_SECONDS: float = 10.0
+    # In-memory cache of AI responses for identical prompts (0 TTL = off)
+    AI_RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    AI_RESPONSE_CACHE_SIZE: int = 1024
+    # Q&A answers reused for repeat questions (case/punctuation-insensitive)
+    # over the same patient data (0 TTL = off)
+    QA_CACHE_TTL_SECONDS: int = 3600
+    QA_CACHE_SIZE: int = 1024
+    # Summarize visits in the background when they are created or updated,
+    # so /agents/summarize is served from the response cache
+    PRECOMPUTE_VISIT_SUMMARIES: bool = False
+    # SQLite file that keeps generated analytics SQL across restarts
+    # (empty = memory only)
+    QUERY_CACHE_DB_PATH: str = ""
 
     # CORS
     BACKEND_CORS_ORIGINS: List[str] = [
@@ -0,0 +1,53 @@
+"""
+Helpers for Alembic data migrations.
+"""
+
+from typing import Optional
+from alembic import op
+from sqlalchemy import text
+
+
+def paged_update(
+    table: str,
+    set_clause: str,
+    where: Optional[str] = None,
+    batch_size: int = 500,
+) -> int:
+    """
+    Run ``UPDATE <table> SET <set_clause>`` in id-ordered batches.
+
+    Each batch commits on its own, so a backfill over a large table never
+    holds one long transaction or loads rows into Python. Batches walk id
+    ranges (keyset pagination) rather than OFFSET, which rescans every
+    skipped row and gets slower with each page.
+
+    Call from an Alembic ``upgrade()``/``downgrade()``; ``table``,
+    ``set_clause`` and ``where`` are trusted SQL fragments. Returns the
+    number of rows updated.
+    """
+    bind = op.get_bind()
+    condition = f" AND ({where})" if where else ""
+
+    next_batch = text(
+        f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > :last_id{condition} "
+        f"ORDER BY id LIMIT :batch_size) AS batch"
+    )
+    update = text(
+        f"UPDATE {table} SET {set_clause} "
+        f"WHERE id > :last_id AND id <= :upper_id{condition}"
+    )
+
+    updated = 0
+    last_id = 0
+    with op.get_context().autocommit_block():
+        while True:
+            upper_id = bind.execute(
+                next_batch, {"last_id": last_id, "batch_size": batch_size}).scalar()
+            if upper_id is None:
+                break
+
+            updated += bind.execute(
+                update, {"last_id": last_id, "upper_id": upper_id}).rowcount
+            last_id = upper_id
+
+    return updated
@@ -5,6 +5,7 @@ Database session management.
 from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.config import settings
 
 # Create async engine with appropriate driver based on database type
@@ -16,11 +17,19 @@ if database_url.startswith("postgresql://"):
 elif database_url.startswith("mysql://"):
     database_url = database_url.replace("mysql://", "mysql+aiomysql://")
 
-engine = create_async_engine(
-    database_url,
-    echo=settings.DEBUG,
-    pool_pre_ping=True,  # Verify connections before using them
-)
+engine_options = {
+    "echo": settings.DEBUG,
+    "pool_pre_ping": True,  # Verify connections before using them
+}
+
+if settings.DATABASE_NULLPOOL:
+    # PgBouncer does the pooling; server-side prepared statements don't
+    # survive transaction pooling, so asyncpg must not cache them
+    engine_options["poolclass"] = NullPool
+    if database_url.startswith("postgresql+asyncpg://"):
+        engine_options["connect_args"] = {"statement_cache_size": 0}
+
+engine = create_async_engine(database_url, **engine_options)
 
 # Create async session factory
 AsyncSessionLocal = sessionmaker(
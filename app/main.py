@@ -11,6 +11,7 @@ import os
 
 from app.config import settings
 from app.api.v1.api import api_router
+from app.agents.base_agent import close_http_client
 from app.database.session import engine
 from app.database.base import Base
 
@@ -55,6 +56,7 @@ async def lifespan(application: FastAPI):
 
     # Shutdown
     logger.info("Shutting down Medical Assistant API")
+    await close_http_client()
 
 
 # Create FastAPI application
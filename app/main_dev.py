@@ -9,6 +9,7 @@ import structlog
 import os
 
 from app.config import settings
+from app.agents.base_agent import close_http_client
 
 # Configure structured logging
 structlog.configure(
@@ -51,6 +52,7 @@ async def lifespan(application: FastAPI):
 
     # Shutdown
     logger.info("Shutting down Medical Assistant API")
+    await close_http_client()
 
 
 # Create FastAPI application
@@ -52,6 +52,19 @@ class QuestionAnswerResponse(BaseModel):
     generated_at: datetime
 
 
+class BatchQuestionAnswerRequest(BaseModel):
+    """Request schema for answering several questions in one call."""
+
+    questions: List[QuestionAnswerRequest] = Field(
+        ..., min_length=1, max_length=20, description="Questions to answer")
+
+
+class BatchQuestionAnswerResponse(BaseModel):
+    """Response schema for batch Q&A, in request order."""
+
+    answers: List[QuestionAnswerResponse]
+
+
 class HealthSummaryRequest(BaseModel):
     """Request schema for patient health summary."""
 
@@ -3,13 +3,20 @@ Visit data models.
 """
 
 from datetime import datetime
+from functools import cached_property
 from typing import Optional, List
 from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel, Field
 from app.database.base import Base
 
 
+def _compact(text: str) -> str:
+    """Collapse runs of whitespace (blank lines, indentation) to single spaces."""
+    return " ".join(text.split())
+
+
 # SQLAlchemy Models
 class Visit(Base):
     """Visit database model."""
@@ -18,10 +25,11 @@ class Visit(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     visit_id = Column(String(50), unique=True, index=True, nullable=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
-    visit_date = Column(DateTime, nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.id"),
+                        nullable=False, index=True)
+    visit_date = Column(DateTime, nullable=False, index=True)
     # routine, emergency, follow-up, etc.
-    visit_type = Column(String(50), nullable=False)
+    visit_type = Column(String(50), nullable=False, index=True)
     chief_complaint = Column(Text)
     symptoms = Column(Text)
     diagnosis = Column(Text)
@@ -29,8 +37,9 @@ class Visit(Base):
     medications_prescribed = Column(Text)
     follow_up_instructions = Column(Text)
     doctor_notes = Column(Text)
-    vital_signs = Column(JSON)  # JSON data for vital signs
-    lab_results = Column(JSON)  # JSON data for lab results
+    # JSONB on PostgreSQL so the GIN indexes can serve containment queries
+    vital_signs = Column(JSON().with_variant(JSONB(), "postgresql"))
+    lab_results = Column(JSON().with_variant(JSONB(), "postgresql"))
     duration_minutes = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow,
@@ -115,6 +124,28 @@ class VisitResponse(VisitBase):
     class Config:
         from_attributes = True
 
+    @cached_property
+    def history_entry(self) -> str:
+        """
+        Visit details as listed in a patient history prompt.
+
+        Formatted once per instance, so a visit list reused across several
+        summaries is not re-formatted for each one. Free-text fields are
+        whitespace-compacted; pasted notes often carry blank lines and
+        indentation that cost prompt tokens without adding content.
+        Not serialized.
+        """
+        lines = [
+            f"   Type: {self.visit_type}\n",
+            f"   Chief Complaint: {self.chief_complaint}\n",
+            f"   Diagnosis: {self.diagnosis}\n",
+        ]
+        if self.treatment_plan:
+            lines.append(f"   Treatment: {_compact(self.treatment_plan)}\n")
+        if self.doctor_notes:
+            lines.append(f"   Notes: {_compact(self.doctor_notes)}\n")
+        return "".join(lines)
+
 
 class VisitSummary(BaseModel):
     """Schema for visit summary."""
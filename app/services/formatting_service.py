@@ -2,8 +2,8 @@
 Service to format medical data for display.
 """
 from typing import Optional
-import json
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +23,7 @@ class MedicalDataFormatter:
             return "No vital signs data available."
 
         try:
-            vital_signs = json.loads(vital_signs_json) if isinstance(
+            vital_signs = orjson.loads(vital_signs_json) if isinstance(
                 vital_signs_json, str) else vital_signs_json
 
             # Define normal ranges for status determination
@@ -123,12 +123,13 @@ class MedicalDataFormatter:
             return "No lab results available."
 
         try:
-            logger.debug(
-                f"Lab results JSON type: {type(lab_results_json)}, content: {str(lab_results_json)[:200]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Lab results JSON type: %s, content: %s",
+                             type(lab_results_json), str(lab_results_json)[:200])
 
             # Handle both JSON string and already-parsed list/dict
             if isinstance(lab_results_json, str):
-                lab_results = json.loads(lab_results_json)
+                lab_results = orjson.loads(lab_results_json)
             elif isinstance(lab_results_json, list):
                 lab_results = lab_results_json
             elif isinstance(lab_results_json, dict):
@@ -139,8 +140,8 @@ class MedicalDataFormatter:
                     f"Unexpected lab_results type: {type(lab_results_json)}")
                 return "Lab results data format not recognized."
 
-            logger.debug(
-                f"Parsed lab results type: {type(lab_results)}, length: {len(lab_results) if lab_results else 0}")
+            logger.debug("Parsed lab results type: %s, length: %d",
+                         type(lab_results), len(lab_results) if lab_results else 0)
 
             if not lab_results or len(lab_results) == 0:
                 logger.debug("Lab results is empty after parsing")
@@ -6,7 +6,6 @@ import logging
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_
-from sqlalchemy.orm import selectinload
 from fastapi import HTTPException
 from app.models.visit import Visit, VisitCreate, VisitUpdate, VisitResponse, VisitSummary
 from app.models.patient import Patient, PatientResponse
@@ -236,15 +235,16 @@ class VisitService:
         logger.info("Retrieving patient for visit DB ID: %d", db_id)
 
         try:
-            query = select(Visit).options(selectinload(
-                Visit.patient)).where(Visit.id == db_id)
+            # One joined query; loading the Visit and then selectin-loading
+            # its patient costs a second round-trip
+            query = select(Patient).join(
+                Visit, Visit.patient_id == Patient.id).where(Visit.id == db_id)
             result = await self.db.execute(query)
-            visit = result.scalar_one_or_none()
+            patient = result.scalar_one_or_none()
 
-            if visit and visit.patient:
-                logger.info("Patient found for visit: %s",
-                            visit.patient.patient_id)
-                return PatientResponse.model_validate(visit.patient)
+            if patient:
+                logger.info("Patient found for visit: %s", patient.patient_id)
+                return PatientResponse.model_validate(patient)
             else:
                 logger.warning("No patient found for visit DB ID: %d", db_id)
                 return None
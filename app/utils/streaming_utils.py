@@ -2,10 +2,10 @@
 Streaming utilities for Server-Sent Events (SSE) responses.
 Provides helpers for streaming AI responses in real-time.
 """
-import json
 import asyncio
 from typing import AsyncGenerator, Dict, Any, Optional
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +24,8 @@ def format_sse_message(data: Dict[str, Any], event: Optional[str] = None) -> str
     message = ""
     if event:
         message += f"event: {event}\n"
-    message += f"data: {json.dumps(data)}\n\n"
+    # Runs once per streamed chunk, hence orjson
+    message += f"data: {orjson.dumps(data).decode()}\n\n"
     return message
 
 
@@ -213,6 +214,50 @@ async def stream_response_with_mermaid_buffering(
         })
 
 
+async def with_heartbeat(
+    messages: AsyncGenerator[str, None],
+    interval: float = 15.0
+) -> AsyncGenerator[str, None]:
+    """
+    Pass SSE messages through, sending a keep-alive comment during gaps.
+
+    A slow first token (or a long Mermaid block being buffered) can leave the
+    connection idle long enough for proxies to drop it. An SSE comment line is
+    ignored by EventSource clients but keeps the connection open.
+
+    Args:
+        messages: Async generator yielding SSE-formatted messages
+        interval: Seconds without a message before a heartbeat is sent
+
+    Yields:
+        The original messages, plus ": keep-alive" comments
+    """
+    iterator = messages.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            finished, pending = pending, None
+            try:
+                message = finished.result()
+            except StopAsyncIteration:
+                return
+            yield message
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        # Close the wrapped stream now (e.g. on client disconnect) so its own
+        # cleanup runs here rather than whenever it is garbage collected
+        if hasattr(messages, "aclose"):
+            await messages.aclose()
+
+
 async def stream_ai_response(
     agent_stream,
     extract_text: bool = True
@@ -172,6 +172,88 @@ class TestAnalyticsExampleQuestions:
             analytics_agent._execute_query = original_execute
 
 
+class TestAnalyticsSqlSafety:
+    """Test the read-only guard and SQL extraction helpers"""
+
+    def test_rejects_write_operations(self):
+        """Write statements are rejected"""
+        assert not analytics_agent._is_safe_query("DELETE FROM visits;")
+        assert not analytics_agent._is_safe_query("SELECT 1; DROP TABLE visits;")
+
+    def test_allows_columns_containing_keywords(self):
+        """Columns such as created_at/updated_at are not write operations"""
+        sql = "SELECT created_at, updated_at FROM visits LIMIT 10;"
+        assert analytics_agent._is_safe_query(sql)
+
+    def test_allows_keywords_inside_literals(self):
+        """Keywords inside string literals don't make a query unsafe"""
+        sql = "SELECT * FROM visits WHERE diagnosis LIKE '%CREATE%' LIMIT 10;"
+        assert analytics_agent._is_safe_query(sql)
+
+    def test_enforce_limit(self):
+        """A LIMIT is added only when the query has none"""
+        limited = analytics_agent._enforce_limit("SELECT id FROM visits")
+        assert limited.upper().endswith("LIMIT 100")
+
+        sql = "SELECT id FROM visits LIMIT 5"
+        assert analytics_agent._enforce_limit(sql) == sql
+
+    def test_enforce_limit_keeps_json_operators(self):
+        """Adding the LIMIT leaves the rest of the query text untouched"""
+        sql = ("SELECT AVG(CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2))) "
+               "FROM visits -- average heart rate\n;")
+
+        limited = analytics_agent._enforce_limit(sql)
+
+        assert limited == ("SELECT AVG(CAST(vital_signs->>'$.heart_rate' AS DECIMAL(6,2))) "
+                           "FROM visits -- average heart rate\nLIMIT 100")
+        assert analytics_agent._is_safe_query(limited)
+
+    def test_extract_sql_strips_markdown_and_prefix(self):
+        """Code fences and SQL: prefixes are removed"""
+        response = "```sql\nSQL: SELECT COUNT(*) FROM visits;\n```\n\nThis counts visits."
+        assert analytics_agent._extract_sql(response) == "SELECT COUNT(*) FROM visits;"
+
+    def test_templates_are_read_only(self):
+        """Startup self-test rejects a template that writes"""
+        from app.agents.analytics_agent import AnalyticsAgent
+
+        agent = AnalyticsAgent.__new__(AnalyticsAgent)
+        agent.templates = analytics_agent.templates
+        agent._validate_templates()
+
+        agent.templates = type("Templates", (), {
+            "templates": {"bad": {"sql": "DELETE FROM visits;", "params": []}}
+        })()
+        with pytest.raises(ValueError):
+            agent._validate_templates()
+
+
+class TestAnalyticsResultFormatting:
+    """Test JSON-ready formatting of query rows"""
+
+    def test_format_results_converts_dates_and_decimals(self):
+        """Dates become ISO strings, Decimals become floats, ints stay ints"""
+        from datetime import date, datetime
+        from decimal import Decimal
+
+        rows = [{
+            "visit_date": datetime(2024, 12, 15, 9, 30),
+            "date_of_birth": date(1980, 1, 15),
+            "avg_heart_rate": Decimal("72.50"),
+            "visit_count": 3,
+            "diagnosis": "Hypertension",
+        }]
+
+        assert analytics_agent._format_results(rows) == [{
+            "visit_date": "2024-12-15T09:30:00",
+            "date_of_birth": "1980-01-15",
+            "avg_heart_rate": 72.5,
+            "visit_count": 3,
+            "diagnosis": "Hypertension",
+        }]
+
+
 if __name__ == "__main__":
     # Run tests directly
     import sys
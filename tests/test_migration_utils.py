@@ -0,0 +1,35 @@
+"""
+Test cases for the Alembic data migration helpers.
+"""
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, text
+
+from app.database.migration_utils import paged_update
+
+
+class TestPagedUpdate:
+    """Test batched UPDATEs over a table."""
+
+    def test_updates_matching_rows_in_batches(self):
+        """Every matching row is updated once, across several batches."""
+        engine = create_engine("sqlite://")
+        with engine.connect() as conn:
+            conn.execute(text("CREATE TABLE visits (id INTEGER PRIMARY KEY, visit_type TEXT)"))
+            conn.execute(text(
+                "INSERT INTO visits (id, visit_type) VALUES "
+                "(1, 'routine'), (2, NULL), (3, NULL), (5, 'urgent'), (8, NULL), (9, NULL)"
+            ))
+            conn.commit()
+
+            with Operations.context(MigrationContext.configure(conn)):
+                updated = paged_update(
+                    "visits", "visit_type = 'routine'",
+                    where="visit_type IS NULL", batch_size=2)
+
+            rows = conn.execute(text("SELECT id, visit_type FROM visits ORDER BY id")).all()
+
+        assert updated == 4
+        assert [row.visit_type for row in rows] == [
+            "routine", "routine", "routine", "urgent", "routine", "routine"]
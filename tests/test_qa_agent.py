@@ -0,0 +1,302 @@
+"""
+Test cases for the Q&A agent helpers.
+"""
+
+import asyncio
+from datetime import date
+import pytest
+from app.agents import qa_agent
+
+
+class TestInsightsBatch:
+    """Test the concurrent batch entry points."""
+
+    @pytest.mark.asyncio
+    async def test_batch_bounds_concurrency_and_keeps_order(self, monkeypatch):
+        """No more than `concurrency` calls run at once; results stay in order."""
+        in_flight = 0
+        peak = 0
+
+        async def fake_insights(patient, visits):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return f"insights for {patient}"
+
+        monkeypatch.setattr(qa_agent, "get_patient_insights", fake_insights)
+
+        results = await qa_agent.get_patient_insights_batch(
+            [(i, []) for i in range(7)], concurrency=3)
+
+        assert results == [f"insights for {i}" for i in range(7)]
+        assert peak == 3
+
+
+class TestInsightsStream:
+    """Test the streaming insight helpers."""
+
+    @pytest.mark.asyncio
+    async def test_insights_stream_yields_agent_chunks(self, monkeypatch):
+        """Chunks from the agent stream are passed through unchanged."""
+        captured = {}
+
+        async def fake_stream(question, **kwargs):
+            captured["question"] = question
+            for chunk in ("Stable ", "trends."):
+                yield chunk
+
+        monkeypatch.setattr(qa_agent.medical_qa_agent, "answer_question_stream", fake_stream)
+        patient = type("Patient", (), {"patient_id": "P1", "first_name": "Ada", "last_name": "Lovelace"})()
+
+        chunks = [c async for c in qa_agent.get_patient_insights_stream(patient, [])]
+
+        assert chunks == ["Stable ", "trends."]
+        assert "Ada Lovelace" in captured["question"]
+
+
+class TestAnswerCache:
+    """Test the Q&A answer cache."""
+
+    @pytest.mark.asyncio
+    async def test_rephrased_repeat_skips_provider(self, monkeypatch):
+        """Case and punctuation changes over the same data reuse the answer."""
+        from app.agents.qa_cache import QAAnswerCache
+
+        calls = []
+
+        async def fake_run(prompt, **kwargs):
+            calls.append(prompt)
+            return "No known allergies."
+
+        agent = qa_agent.MedicalQAAgent()
+        agent.answer_cache = QAAnswerCache()
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        patients = [{"first_name": "Ada", "last_name": "Lovelace"}]
+
+        assert await agent.answer_question("Any allergies?", patients=patients) == "No known allergies."
+        assert await agent.answer_question("any   ALLERGIES", patients=patients) == "No known allergies."
+        assert len(calls) == 1
+
+        # Different patient data is a different entry
+        await agent.answer_question("Any allergies?", patients=[{"first_name": "Alan"}])
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_answer_not_cached(self, monkeypatch):
+        """Provider errors are returned but never cached."""
+        from app.agents.qa_cache import QAAnswerCache
+
+        async def failing_run(prompt, **kwargs):
+            raise Exception("All AI providers failed")
+
+        agent = qa_agent.MedicalQAAgent()
+        agent.answer_cache = QAAnswerCache()
+        monkeypatch.setattr(agent.agent, "run_async", failing_run)
+
+        await agent.answer_question("Any allergies?")
+        assert len(agent.answer_cache) == 0
+
+
+class TestBatchAnswer:
+    """Test MedicalQAAgent.batch_answer."""
+
+    @pytest.mark.asyncio
+    async def test_batch_answer_passes_context_and_keeps_order(self, monkeypatch):
+        """Each question is answered with its own context, in input order."""
+        agent = qa_agent.MedicalQAAgent()
+
+        async def fake_answer(question, **kwargs):
+            await asyncio.sleep(0.01 * len(question))
+            return f"{question}:{len(kwargs.get('patients') or [])}"
+
+        monkeypatch.setattr(agent, "answer_question", fake_answer)
+
+        answers = await agent.batch_answer([
+            ("Longest question", {"patients": [{}, {}]}),
+            ("Short", {}),
+        ])
+
+        assert answers == ["Longest question:2", "Short:0"]
+
+
+
+class TestPromptBuilder:
+    """Test the shared prompt builder."""
+
+    @pytest.mark.asyncio
+    async def test_stream_and_plain_send_same_prompt(self, monkeypatch):
+        """Both answer paths build the prompt from one place."""
+        agent = qa_agent.MedicalQAAgent()
+        agent.answer_cache = None
+        prompts = []
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            return "ok"
+
+        async def fake_stream(prompt, **kwargs):
+            prompts.append(prompt)
+            yield "ok"
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        monkeypatch.setattr(agent.agent, "run_stream", fake_stream)
+        visits = [{"visit_date": date(2024, 3, 1), "duration_minutes": 30}]
+
+        await agent.answer_question("Q?", visits=visits)
+        [chunk async for chunk in agent.answer_question_stream("Q?", visits=visits)]
+
+        assert prompts[0] == prompts[1]
+
+    def test_no_records_sends_terse_prompt(self):
+        """Without patients or visits only the question and IDs are sent."""
+        prompt = qa_agent.MedicalQAAgent._build_prompt("Q?", None, [], patient_id="P1")
+
+        assert prompt.startswith("Question: Q?\nPatient ID: P1\nVisit ID: -\n")
+        assert "Markdown tables" not in prompt
+
+    @pytest.mark.asyncio
+    async def test_open_circuits_return_unavailable_answer(self, monkeypatch):
+        """answer_question turns an all-open breaker state into a clear reply."""
+        from app.agents.base_agent import ProvidersUnavailableError
+
+        agent = qa_agent.MedicalQAAgent()
+        agent.answer_cache = None
+
+        async def unavailable(prompt, **kwargs):
+            raise ProvidersUnavailableError("all open")
+
+        monkeypatch.setattr(agent.agent, "run_async", unavailable)
+
+        assert await agent.answer_question("Q?") == qa_agent._UNAVAILABLE_ANSWER
+
+
+class TestAnswerQuestions:
+    """Test MedicalQAAgent.answer_questions."""
+
+    @pytest.mark.asyncio
+    async def test_one_call_split_by_answer_markers(self, monkeypatch):
+        """The shared context is sent once and the reply split per question."""
+        agent = qa_agent.MedicalQAAgent()
+        prompts = []
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            return "Preamble\n### Answer 1\nNone known.\n\n### Answer 2\nLisinopril."
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        patients = [{"first_name": "Ada", "last_name": "Lovelace"}]
+
+        answers = await agent.answer_questions(
+            ["Any allergies?", "Current medications?"], patients=patients)
+
+        assert answers == ["None known.", "Lisinopril."]
+        assert len(prompts) == 1
+        assert prompts[0].count("Patient Ada Lovelace") == 1
+        assert "1. Any allergies?\n2. Current medications?\n" in prompts[0]
+
+    @pytest.mark.asyncio
+    async def test_unparseable_reply_falls_back_to_separate_calls(self, monkeypatch):
+        """A reply missing an answer marker is retried one question at a time."""
+        agent = qa_agent.MedicalQAAgent()
+        agent.answer_cache = None
+        prompts = []
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            if prompt.startswith("Questions:"):
+                return "### Answer 1\nOnly one answer."
+            return f"answer to {prompt.partition(chr(10))[0]}"
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+
+        answers = await agent.answer_questions(["A?", "B?"])
+
+        assert answers == ["answer to Question: A?", "answer to Question: B?"]
+        assert len(prompts) == 3
+
+
+class TestLegacyAnswer:
+    """Test the legacy answer_question wrapper."""
+
+    @pytest.mark.asyncio
+    async def test_returns_qa_response_with_model_dump(self, monkeypatch):
+        """The legacy wrapper still exposes the model_dump() dict shape."""
+        async def fake_answer(**kwargs):
+            return "No known allergies."
+
+        monkeypatch.setattr(qa_agent.medical_qa_agent, "answer_question", fake_answer)
+
+        response = await qa_agent.answer_question("Any allergies?", patients=[{}])
+
+        assert response.model_dump()["answer"] == "No known allergies."
+        assert response.context_used == "Patients: 1, Visits: 0"
+        assert not hasattr(response, "__dict__")
+
+
+class TestBatchEndpoint:
+    """Test the /agents/ask/batch endpoint."""
+
+    @pytest.mark.asyncio
+    async def test_shared_scope_loaded_once_and_answers_in_order(self, monkeypatch):
+        """Questions about the same patient share one context load."""
+        from fastapi import BackgroundTasks
+        from app.api.v1.endpoints import agents
+        from app.models.schemas import BatchQuestionAnswerRequest
+
+        loads = []
+
+        async def fake_load(request, db):
+            loads.append(request.patient_id)
+            return [{"first_name": "Ada"}], []
+
+        async def fake_batch(items):
+            return [f"{question}:{kwargs['patient_id']}" for question, kwargs in items]
+
+        monkeypatch.setattr(agents, "_load_qa_context", fake_load)
+        monkeypatch.setattr(agents.medical_qa_agent, "batch_answer", fake_batch)
+        request = BatchQuestionAnswerRequest(questions=[
+            {"question": "Allergies?", "patient_id": 1},
+            {"question": "Medications?", "patient_id": 1},
+            {"question": "Visits?", "patient_id": 2},
+        ])
+
+        response = await agents.ask_questions_batch_endpoint(request, BackgroundTasks(), db=None)
+
+        assert [a.answer for a in response.answers] == ["Allergies?:1", "Medications?:1", "Visits?:2"]
+        assert loads == [1, 2]
+
+
+class TestConcurrentFetch:
+    """Test the endpoint helper for concurrent context reads."""
+
+    @pytest.mark.asyncio
+    async def test_fetches_overlap_on_separate_sessions(self):
+        """Each fetch gets its own session; results keep argument order."""
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        from app.api.v1.endpoints import agents
+
+        engine = create_async_engine("sqlite+aiosqlite://")
+        sessions = []
+        in_flight = 0
+        peak = 0
+
+        def fetch(delay, value):
+            async def run(session):
+                nonlocal in_flight, peak
+                sessions.append(session)
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(delay)
+                in_flight -= 1
+                return value
+            return run
+
+        async with AsyncSession(engine) as db:
+            results = await agents._fetch_concurrently(db, fetch(0.02, "patient"), fetch(0.01, "visits"))
+        await engine.dispose()
+
+        assert results == ["patient", "visits"]
+        assert peak == 2
+        assert sessions[0] is not sessions[1] and db not in sessions
@@ -0,0 +1,114 @@
+"""
+Test cases for the Q&A prompt templates.
+"""
+
+from datetime import date
+from app.agents.qa_agent import _MAX_PROMPT_VISITS, _VISIT_TOKEN_BUDGET, _recent_visits
+from app.agents.templates import QA_PROMPT
+
+
+class TestQATemplates:
+    """Test prompt rendering for dict and model inputs."""
+
+    def test_renders_dict_records_with_defaults(self):
+        """Missing fields fall back to Unknown / N/A like the old builder."""
+        prompt = QA_PROMPT.render(
+            question="Any allergies?",
+            patients=[{"first_name": "Ada", "last_name": "Lovelace",
+                       "date_of_birth": date(1990, 1, 1), "allergies": "Penicillin"}],
+            visits=[{"visit_date": date(2024, 3, 1)}],
+        )
+
+        assert prompt.startswith("Question: Any allergies?\nPatient Information:\n")
+        assert "- Patient Ada Lovelace (DOB: 1990-01-01)\n  Allergies: Penicillin\n" in prompt
+        assert "- Visit 2024-03-01 (Unknown)\n  Chief Complaint: N/A\n" in prompt
+        assert "Medical History" not in prompt
+
+    def test_duration_included_when_present(self):
+        """Visit duration is listed when recorded."""
+        visits = [{"visit_date": date(2024, 3, 1), "duration_minutes": 30}]
+
+        assert "  Duration: 30 minutes\n" in QA_PROMPT.render(question="Q", visits=visits)
+        assert "Duration" not in QA_PROMPT.render(
+            question="Q", visits=[{"visit_date": date(2024, 3, 1)}])
+
+    def test_recent_visits_picks_newest_regardless_of_order(self):
+        """The prompt gets the newest visits even when input is unsorted."""
+        visits = [{"visit_date": date(2024, 1, day)} for day in range(1, 31)]
+        recent = _recent_visits(visits)
+
+        assert len(recent) == _MAX_PROMPT_VISITS
+        assert recent[0]["visit_date"] == date(2024, 1, 30)
+        assert recent == sorted(visits, key=lambda v: v["visit_date"], reverse=True)[:_MAX_PROMPT_VISITS]
+
+    def test_long_visits_limited_by_token_budget(self):
+        """Visits with long notes are packed newest-first until the budget is spent."""
+        notes = "x" * (_VISIT_TOKEN_BUDGET * 4 // 3)
+        visits = [{"visit_date": date(2024, 1, day), "doctor_notes": notes}
+                  for day in range(1, 6)]
+
+        recent = _recent_visits(visits)
+
+        assert [v["visit_date"].day for v in recent] == [5, 4]
+
+    def test_omitted_visits_noted_in_prompt(self):
+        """The prompt says how many older visits were left out."""
+        from app.agents.qa_agent import MedicalQAAgent
+
+        visits = [{"visit_date": date(2024, 1, day)} for day in range(1, 31)]
+
+        prompt = MedicalQAAgent._build_prompt("Q", None, visits)
+
+        assert "(Older visits omitted: 5)\n" in prompt
+        assert "omitted" not in MedicalQAAgent._build_prompt("Q", None, visits[:3])
+
+    def test_oversized_single_visit_is_kept(self):
+        """The newest visit is included even if it alone exceeds the budget."""
+        visits = [{"visit_date": date(2024, 1, 1), "doctor_notes": "x" * _VISIT_TOKEN_BUDGET * 8}]
+
+        assert _recent_visits(visits) == visits
+
+    def test_vitals_formatted_once_per_payload(self, monkeypatch):
+        """Repeat renders of the same vitals reuse the cached Markdown."""
+        from app.agents import templates
+
+        calls = []
+
+        def fake_format(value):
+            calls.append(value)
+            return "| vitals |"
+
+        monkeypatch.setitem(templates._ENV.filters, "vital_signs_table",
+                            templates._memoized(fake_format))
+        visits = [{"visit_date": date(2024, 3, 1), "vital_signs": {"heart_rate": 70}}]
+
+        for _ in range(3):
+            prompt = QA_PROMPT.render(question="Q", visits=visits)
+
+        assert "| vitals |" in prompt
+        assert calls == [{"heart_rate": 70}]
+
+
+class TestVisitSummaryTemplate:
+    """Test the visit summarizer prompt."""
+
+    def test_optional_sections_only_when_present(self):
+        """Patient block and optional visit lines appear only when set."""
+        from app.agents.templates import VISIT_SUMMARY_PROMPT
+
+        visit = {"id": 7, "visit_date": date(2024, 3, 1), "visit_type": "routine",
+                 "chief_complaint": "Cough", "diagnosis": "URI", "doctor_notes": "Rest"}
+
+        prompt = VISIT_SUMMARY_PROMPT.render(visit=visit, patient=None)
+
+        assert prompt.startswith("Please create a comprehensive medical visit summary")
+        assert "\n\nVisit Information:\n- Visit ID: 7\n- Date: 2024-03-01\n" in prompt
+        assert "- Clinical Notes: Rest\n" in prompt
+        assert "Treatment Plan" not in prompt
+
+        patient = {"first_name": "Ada", "last_name": "Lovelace", "id": 1,
+                   "date_of_birth": date(1990, 1, 1), "gender": "female"}
+        prompt = VISIT_SUMMARY_PROMPT.render(visit=visit, patient=patient)
+
+        assert "details.\n\nPatient Information:\n- Name: Ada Lovelace\n" in prompt
+        assert "- Gender: female\n\nVisit Information:\n" in prompt
@@ -0,0 +1,110 @@
+"""
+Test cases for the analytics QueryCache.
+"""
+
+import pytest
+from app.agents.query_cache import QueryCache
+
+
+class TestQueryCache:
+    """Test question normalization and lookup."""
+
+    @pytest.mark.asyncio
+    async def test_equivalent_questions_share_entry(self):
+        """Case, whitespace and trailing punctuation hit the same entry."""
+        cache = QueryCache()
+        await cache.set("How many visits in the last 30 days?",
+                        "SELECT COUNT(*) FROM visits;")
+
+        assert await cache.get("how many visits in the last 30 days") == "SELECT COUNT(*) FROM visits;"
+        assert await cache.get("  HOW MANY VISITS  in the last 30 days!") == "SELECT COUNT(*) FROM visits;"
+
+    @pytest.mark.asyncio
+    async def test_miss_returns_none(self):
+        """Unknown questions return None."""
+        cache = QueryCache()
+        assert await cache.get("How many patients?") is None
+
+    @pytest.mark.asyncio
+    async def test_explanation_tied_to_result_signature(self):
+        """Explanations are only reused for the same result signature."""
+        cache = QueryCache()
+        await cache.set("How many patients?", "SELECT COUNT(*) FROM patients;")
+        cache.set_explanation("How many patients?", b"sig-1", "There are 42 patients.")
+
+        assert cache.get_explanation("how many patients", b"sig-1") == "There are 42 patients."
+        assert cache.get_explanation("how many patients", b"sig-2") is None
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_evicted_past_max_size(self):
+        """A lookup refreshes an entry; the stalest one is dropped first."""
+        cache = QueryCache(max_size=2)
+        await cache.set("q1", "SELECT 1;")
+        await cache.set("q2", "SELECT 2;")
+        await cache.get("q1")
+        await cache.set("q3", "SELECT 3;")
+
+        assert await cache.get("q2") is None
+        assert await cache.get("q1") == "SELECT 1;"
+        assert await cache.get("q3") == "SELECT 3;"
+
+    @pytest.mark.asyncio
+    async def test_expired_entry_dropped_on_lookup(self, monkeypatch):
+        """Entries past the TTL are removed when looked up."""
+        from app.agents import query_cache
+
+        now = 1000.0
+        monkeypatch.setattr(query_cache.time, "monotonic", lambda: now)
+        cache = QueryCache(ttl_hours=1)
+        await cache.set("How many patients?", "SELECT COUNT(*) FROM patients;")
+
+        now += 3599
+        assert await cache.get("How many patients?") == "SELECT COUNT(*) FROM patients;"
+        now += 2
+        assert await cache.get("How many patients?") is None
+        assert len(cache.cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_stats_hit_rate_counts_misses(self):
+        """Hit rate is hits over lookups; most_popular lists the top entries."""
+        cache = QueryCache()
+        await cache.set("q1", "SELECT 1;")
+        await cache.set("q2", "SELECT 2;")
+        await cache.get("q1")
+        await cache.get("q1")
+        await cache.get("q2")
+        await cache.get("unknown")
+
+        stats = cache.get_stats()
+
+        assert stats["cache_hit_rate"] == "75.0%"
+        assert stats["most_popular"][0] == {"question": "q1", "hits": 2}
+
+    @pytest.mark.asyncio
+    async def test_sqlite_store_survives_restart(self, tmp_path):
+        """SQL written through one cache is served by a new one on the same file."""
+        from app.agents.sqlite_cache import SQLiteQueryStore
+
+        path = str(tmp_path / "query_cache.sqlite3")
+        first = QueryCache(store=SQLiteQueryStore(path))
+        await first.set("How many patients?", "SELECT COUNT(*) FROM patients;")
+        first.store.close()
+
+        second = QueryCache(store=SQLiteQueryStore(path))
+
+        assert await second.get("how many patients") == "SELECT COUNT(*) FROM patients;"
+        assert "howmanypatients" in second.cache
+        assert await second.get("How many visits?") is None
+
+    @pytest.mark.asyncio
+    async def test_stored_sql_revalidated_on_load(self, tmp_path):
+        """Rows from the SQLite file are checked before they are served."""
+        from app.agents.sqlite_cache import SQLiteQueryStore
+
+        path = str(tmp_path / "query_cache.sqlite3")
+        store = SQLiteQueryStore(path)
+        store.set("howmanypatients", "How many patients?", "DELETE FROM patients;", 4e9)
+        cache = QueryCache(store=store, validate=lambda sql: sql.startswith("SELECT"))
+
+        assert await cache.get("How many patients?") is None
+        assert "howmanypatients" not in cache.cache
@@ -0,0 +1,59 @@
+"""
+Test cases for the SSE streaming helpers.
+"""
+
+import asyncio
+import pytest
+from app.utils.streaming_utils import with_heartbeat
+
+
+class TestHeartbeat:
+    """Test keep-alive comments on idle streams."""
+
+    @pytest.mark.asyncio
+    async def test_idle_gap_sends_keep_alive_and_keeps_order(self):
+        """A slow message is preceded by heartbeats and still delivered."""
+        async def messages():
+            yield "data: 1\n\n"
+            await asyncio.sleep(0.05)
+            yield "data: 2\n\n"
+
+        out = [m async for m in with_heartbeat(messages(), interval=0.02)]
+
+        assert out[0] == "data: 1\n\n"
+        assert out[-1] == "data: 2\n\n"
+        assert ": keep-alive\n\n" in out[1:-1]
+
+    @pytest.mark.asyncio
+    async def test_no_heartbeat_when_messages_flow(self):
+        """Messages arriving within the interval pass through unchanged."""
+        async def messages():
+            for i in range(3):
+                yield f"data: {i}\n\n"
+
+        out = [m async for m in with_heartbeat(messages(), interval=1.0)]
+
+        assert out == ["data: 0\n\n", "data: 1\n\n", "data: 2\n\n"]
+
+    @pytest.mark.asyncio
+    async def test_early_close_closes_wrapped_stream(self):
+        """Closing the heartbeat stream runs the inner stream's cleanup."""
+        closed = []
+
+        async def messages():
+            try:
+                yield "data: 1\n\n"
+                await asyncio.sleep(10)
+                yield "data: 2\n\n"
+            finally:
+                closed.append(True)
+
+        for wait_for_heartbeat in (False, True):
+            closed.clear()
+            stream = with_heartbeat(messages(), interval=0.01)
+            assert await stream.__anext__() == "data: 1\n\n"
+            if wait_for_heartbeat:
+                assert await stream.__anext__() == ": keep-alive\n\n"
+            await stream.aclose()
+
+            assert closed == [True]
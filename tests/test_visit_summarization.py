@@ -157,6 +157,11 @@ class TestVisitSummarizationAPI:
         assert "patient_id" in data
 
 
+async def _collect(stream):
+    """Drain an async iterator into a list."""
+    return [chunk async for chunk in stream]
+
+
 class TestFallbackSystem:
     """Test the AI provider fallback system specifically."""
 
@@ -270,6 +275,617 @@ class TestFallbackSystem:
             # Check result
             assert result == "Grok-3 medical summary response"
 
+    def test_result_text_attribute_is_cached(self):
+        """The result attribute is probed once per result type, then reused."""
+        from app.agents.base_agent import _EXTRACTORS, _RESULT_ATTRS
+
+        class Result:
+            output = "first"
+
+        assert FallbackAgent._result_text(Result()) == "first"
+        assert (Result, _RESULT_ATTRS) in _EXTRACTORS
+
+        result = Result()
+        result.output = "second"
+        assert FallbackAgent._result_text(result) == "second"
+
+    def test_run_sync_reuses_event_loop(self):
+        """run_sync runs every call on the same persistent loop."""
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = None
+        loops = []
+
+        async def run(user_input):
+            loops.append(asyncio.get_running_loop())
+            return Mock(data=f"echo {user_input}")
+
+        agent._sync_run_chain = [("test", run)]
+
+        assert agent.run_sync("one") == "echo one"
+        assert agent.run_sync("two") == "echo two"
+        assert loops[0] is loops[1]
+
+    def test_run_sync_agents_use_their_own_http_client(self, monkeypatch):
+        """The run_sync loop never shares the app loop's connection pool."""
+        from app.agents import base_agent
+
+        monkeypatch.setattr(base_agent.settings, "OPENAI_API_KEY", "test-key")
+        agent = FallbackAgent("Test prompt for sync client")
+
+        app_agent = agent._setup_agents()["openai"]
+        sync_agent = agent._setup_agents(for_sync_loop=True)["openai"]
+
+        assert app_agent is not sync_agent
+        assert sync_agent is agent._setup_agents(for_sync_loop=True)["openai"]
+
+    def test_run_sync_rejects_calls_from_its_own_loop(self):
+        """run_sync raises instead of deadlocking on its own loop thread."""
+        from app.agents.base_agent import _get_sync_loop
+
+        agent = FallbackAgent("Test prompt")
+
+        async def call_sync():
+            agent.run_sync("Test input")
+
+        future = asyncio.run_coroutine_threadsafe(call_sync(), _get_sync_loop())
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_run_sync_rejects_calls_from_any_running_loop(self):
+        """Called from async code, run_sync raises instead of blocking the loop."""
+        agent = FallbackAgent("Test prompt")
+        agent._sync_run_chain = []
+
+        with pytest.raises(RuntimeError):
+            agent.run_sync("Test input")
+
+    @pytest.mark.asyncio
+    async def test_slow_provider_is_hedged(self):
+        """A provider slower than hedge_delay is raced and the loser cancelled."""
+        agent = FallbackAgent("Test prompt", hedge_delay=0.01)
+        agent.response_cache = None
+        cancelled = []
+
+        async def slow(user_input):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("slow")
+                raise
+
+        async def fast(user_input):
+            return Mock(data="fast response")
+
+        agent._run_chain = [("slow", slow), ("fast", fast)]
+
+        assert await agent.run_async("Test input") == "fast response"
+        assert cancelled == ["slow"]
+
+    @pytest.mark.asyncio
+    async def test_slow_successful_provider_hedged_at_most_once(self):
+        """However slow the primary, only one extra provider is called."""
+        agent = FallbackAgent("Test prompt", hedge_delay=0.01)
+        agent.response_cache = None
+        calls = []
+
+        async def slow(user_input):
+            calls.append("slow")
+            await asyncio.sleep(0.05)
+            return Mock(data="slow response")
+
+        async def stuck(user_input):
+            calls.append("stuck")
+            await asyncio.sleep(10)
+
+        agent._run_chain = [("slow", slow), ("stuck", stuck), ("last", stuck)]
+
+        assert await agent.run_async("Test input") == "slow response"
+        assert calls == ["slow", "stuck"]
+
+    @pytest.mark.asyncio
+    async def test_failed_provider_falls_back_immediately(self):
+        """A failing provider hands over to the next without waiting."""
+        agent = FallbackAgent("Test prompt", hedge_delay=10)
+        agent.response_cache = None
+
+        async def broken(user_input):
+            raise Exception("provider down")
+
+        async def working(user_input):
+            return Mock(data="fallback response")
+
+        agent._run_chain = [("broken", broken), ("working", working)]
+
+        result = await asyncio.wait_for(agent.run_async("Test input"), timeout=1)
+        assert result == "fallback response"
+
+    @pytest.mark.asyncio
+    async def test_circuit_breaker_skips_failing_provider(self):
+        """After repeated failures a provider is skipped until its breaker resets."""
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = None
+        calls = []
+
+        async def broken(user_input):
+            calls.append("broken")
+            raise Exception("provider down")
+
+        async def working(user_input):
+            return Mock(data="ok")
+
+        agent._run_chain = [("broken", broken), ("working", working)]
+        breaker = agent._breakers["broken"]
+
+        for _ in range(breaker.failure_threshold):
+            await agent.run_async("Test input")
+        assert breaker.state == "open"
+
+        await agent.run_async("Test input")
+        assert len(calls) == breaker.failure_threshold
+
+        # Once open_duration passes, one probe is let through
+        breaker.opened_at -= breaker.open_duration
+        assert breaker.state == "half_open"
+        await agent.run_async("Test input")
+        assert len(calls) == breaker.failure_threshold + 1
+        assert breaker.state == "open"
+
+    @pytest.mark.asyncio
+    async def test_all_circuits_open_fails_fast(self):
+        """With every breaker open, run_async raises without calling anyone."""
+        from app.agents.base_agent import ProvidersUnavailableError
+
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = None
+        calls = []
+
+        async def run(user_input):
+            calls.append(user_input)
+            return Mock(data="ok")
+
+        agent._run_chain = [("test", run)]
+        agent._breakers["test"].record_failure(trip=True)
+
+        with pytest.raises(ProvidersUnavailableError):
+            await agent.run_async("Test input")
+        assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_identical_prompt_served_from_cache(self):
+        """A repeated prompt is answered from the response cache."""
+        from app.agents.cache import LLMCache
+
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = LLMCache()
+        calls = []
+
+        async def run(user_input):
+            calls.append(user_input)
+            return Mock(data="cached answer")
+
+        agent._run_chain = [("test", run)]
+
+        assert await agent.run_async("Same question") == "cached answer"
+        assert await agent.run_async("Same question") == "cached answer"
+        assert calls == ["Same question"]
+
+    @pytest.mark.asyncio
+    async def test_run_stream_batches_small_deltas(self):
+        """Token deltas are coalesced into fewer, larger chunks."""
+        from contextlib import asynccontextmanager
+
+        tokens = ["token%02d " % i for i in range(10)]
+
+        class StreamResult:
+            async def __aiter__(self):
+                text = ""
+                for token in tokens:
+                    text += token
+                    yield text
+
+        class StreamingAgent:
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                yield StreamResult()
+
+        agent = FallbackAgent("Test prompt", stream_batch_size=30, stream_batch_interval=60)
+        agent.response_cache = None
+        agent._ordered_agents = [("test", StreamingAgent())]
+
+        chunks = [chunk async for chunk in agent.run_stream("Test input")]
+
+        assert "".join(chunks) == "".join(tokens)
+        assert len(chunks) == 3
+
+    @pytest.mark.asyncio
+    async def test_streamed_answer_is_cached(self):
+        """A completed stream is cached and replayed for the same prompt."""
+        from contextlib import asynccontextmanager
+        from app.agents.cache import LLMCache
+
+        calls = []
+
+        class StreamResult:
+            async def stream_text(self, *, delta=False, debounce_by=0.1):
+                for token in ("Cached", " stream"):
+                    yield token
+
+        class StreamingAgent:
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                calls.append(user_input)
+                yield StreamResult()
+
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = LLMCache()
+        agent._ordered_agents = [("test", StreamingAgent())]
+
+        first = [chunk async for chunk in agent.run_stream("Same question")]
+        second = [chunk async for chunk in agent.run_stream("Same question")]
+
+        assert "".join(first) == "Cached stream"
+        assert second == ["Cached stream"]
+        assert calls == ["Same question"]
+
+    @pytest.mark.asyncio
+    async def test_run_stream_uses_native_text_deltas(self):
+        """Results with stream_text(delta=True) are streamed without diffing."""
+        from contextlib import asynccontextmanager
+
+        calls = []
+
+        class StreamResult:
+            def stream(self):
+                raise AssertionError("cumulative stream() should not be used")
+
+            async def stream_text(self, *, delta=False, debounce_by=0.1):
+                calls.append((delta, debounce_by))
+                for token in ("Hello", " there"):
+                    yield token
+
+        class StreamingAgent:
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                yield StreamResult()
+
+        agent = FallbackAgent("Test prompt")
+        agent.response_cache = None
+        agent._ordered_agents = [("test", StreamingAgent())]
+
+        chunks = [chunk async for chunk in agent.run_stream("Test input")]
+
+        assert "".join(chunks) == "Hello there"
+        assert calls == [(True, None)]
+
+    @pytest.mark.asyncio
+    async def test_slow_stream_start_is_hedged(self):
+        """A provider slow to start streaming is raced and cancelled by the next."""
+        from contextlib import asynccontextmanager
+
+        cancelled = []
+
+        class StreamResult:
+            def __init__(self, tokens):
+                self.tokens = tokens
+
+            async def stream_text(self, *, delta=False, debounce_by=0.1):
+                for token in self.tokens:
+                    yield token
+
+        class SlowAgent:
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append("slow")
+                    raise
+                yield StreamResult(["slow"])
+
+        class FastAgent:
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                yield StreamResult(["fast", " answer"])
+
+        agent = FallbackAgent("Test prompt", hedge_delay=0.01)
+        agent.response_cache = None
+        agent._ordered_agents = [("slow", SlowAgent()), ("fast", FastAgent())]
+
+        chunks = await asyncio.wait_for(_collect(agent.run_stream("Test input")), timeout=1)
+
+        assert "".join(chunks) == "fast answer"
+        assert cancelled == ["slow"]
+        assert agent._breakers["slow"].failures == 0
+
+    @pytest.mark.asyncio
+    async def test_slow_stream_start_hedged_at_most_once(self):
+        """However long the first text takes, only one extra provider is started."""
+        from contextlib import asynccontextmanager
+
+        started = []
+
+        class StreamResult:
+            async def stream_text(self, *, delta=False, debounce_by=0.1):
+                yield "late answer"
+
+        class SlowAgent:
+            def __init__(self, name):
+                self.name = name
+
+            @asynccontextmanager
+            async def run_stream(self, user_input):
+                started.append(self.name)
+                await asyncio.sleep(0.05 if self.name == "first" else 10)
+                yield StreamResult()
+
+        agent = FallbackAgent("Test prompt", hedge_delay=0.005)
+        agent.response_cache = None
+        agent._ordered_agents = [(name, SlowAgent(name)) for name in ("first", "second", "third")]
+
+        chunks = await asyncio.wait_for(_collect(agent.run_stream("Test input")), timeout=1)
+
+        assert "".join(chunks) == "late answer"
+        assert started == ["first", "second"]
+
+    def test_circuit_breaker_trips_on_rate_limit(self):
+        """A rate-limit error opens the breaker immediately."""
+        from app.agents.base_agent import CircuitBreaker, _is_tripping_error
+
+        error = Exception("rate limited")
+        error.status_code = 429
+
+        breaker = CircuitBreaker()
+        breaker.record_failure(_is_tripping_error(error))
+        assert breaker.state == "open"
+
+    @pytest.mark.asyncio
+    async def test_rejected_credentials_disable_provider(self):
+        """A 401 disables the provider for good; later calls skip it."""
+        agent = FallbackAgent("Test prompt", hedge_delay=0)
+        agent.response_cache = None
+        calls = []
+
+        async def unauthorized(user_input):
+            calls.append("bad")
+            error = Exception("invalid api key")
+            error.status_code = 401
+            raise error
+
+        async def working(user_input):
+            return Mock(data="ok")
+
+        agent._run_chain = [("bad", unauthorized), ("good", working)]
+        breaker = agent._breakers["bad"]
+
+        assert await agent.run_async("first") == "ok"
+        breaker.opened_at -= breaker.open_duration
+        assert await agent.run_async("second") == "ok"
+
+        assert calls == ["bad"]
+        assert breaker.state == "disabled"
+
+    def test_available_providers_skip_tripped_breakers(self):
+        """Disabled providers and open breakers in cooldown are not reported as available."""
+        agent = FallbackAgent("Test prompt")
+        agent.agents = {"bad": Mock(), "flaky": Mock(), "good": Mock(), "missing": None}
+
+        agent._breakers["bad"].disabled = True
+        flaky = agent._breakers["flaky"]
+        flaky.record_failure(trip=True)
+        assert agent.get_available_providers() == ["good"]
+
+        flaky.opened_at -= flaky.open_duration
+        assert agent.get_available_providers() == ["flaky", "good"]
+        assert not flaky.probing
+
+    @pytest.mark.asyncio
+    async def test_hung_provider_times_out_to_fallback(self, monkeypatch):
+        """A provider that never answers is abandoned after its timeout."""
+        from app.agents import base_agent
+
+        monkeypatch.setitem(base_agent._PROVIDER_TIMEOUTS, "hung", 0.01)
+        agent = FallbackAgent("Test prompt", hedge_delay=0)
+        agent.response_cache = None
+
+        async def hung(user_input):
+            await asyncio.sleep(10)
+
+        async def working(user_input):
+            return Mock(data="fallback response")
+
+        agent._run_chain = [("hung", hung), ("working", working)]
+
+        result = await asyncio.wait_for(agent.run_async("Test input"), timeout=1)
+        assert result == "fallback response"
+        assert agent._breakers["hung"].failures == 1
+
+    @pytest.mark.asyncio
+    async def test_run_deadline_caps_whole_call(self, monkeypatch):
+        """run_async gives up once the overall deadline passes, whatever the per-provider timeouts."""
+        from app.agents import base_agent
+
+        monkeypatch.setattr(base_agent, "_RUN_DEADLINE", 0.05)
+        agent = FallbackAgent("Test prompt", hedge_delay=0)
+        agent.response_cache = None
+
+        async def hung(user_input):
+            await asyncio.sleep(10)
+
+        agent._run_chain = [("hung", hung)]
+
+        with pytest.raises(Exception, match="did not answer within"):
+            await asyncio.wait_for(agent.run_async("Test input"), timeout=1)
+        assert agent._breakers["hung"].failures == 0
+
+    def test_rate_limit_backoff_grows_and_is_capped(self):
+        """Backoff doubles per rate limit, plus jitter, up to the cap."""
+        from app.agents.base_agent import (
+            _BACKOFF_BASE, _BACKOFF_CAP, _BACKOFF_JITTER, _backoff_delay)
+
+        assert _BACKOFF_BASE <= _backoff_delay(0) <= _BACKOFF_BASE + _BACKOFF_JITTER
+        assert 2 * _BACKOFF_BASE <= _backoff_delay(1) <= 2 * _BACKOFF_BASE + _BACKOFF_JITTER
+        assert _backoff_delay(20) <= _BACKOFF_CAP + _BACKOFF_JITTER
+
+
+class TestPatientHistorySummary:
+    """Test chunked summarization of long visit histories."""
+
+    @pytest.mark.asyncio
+    async def test_long_history_summarized_in_chunks(self, monkeypatch):
+        """Long histories are summarized per chunk, then once overall."""
+        from types import SimpleNamespace
+        from app.agents.summarizer_fallback import VisitSummarizerAgent
+
+        agent = VisitSummarizerAgent()
+        prompts = []
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            return f"summary {len(prompts)}"
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        patient = SimpleNamespace(first_name="Ada", last_name="Lovelace", id=1,
+                                  date_of_birth=date(1990, 1, 1), gender="female",
+                                  medical_history=None)
+        visits = [SimpleNamespace(visit_date=date(2024, 1, day), history_entry=f"Day {day}\n")
+                  for day in range(1, 26)]
+
+        result = await agent.summarize_patient_history(patient, visits)
+
+        assert result == "summary 4"
+        assert len(prompts) == 4
+        assert "1. Visit on 2024-01-25:" in prompts[0]
+        assert "21. Visit on 2024-01-05:" in prompts[2]
+        assert "Visits 1-10 (2024-01-16 to 2024-01-25):" in prompts[3]
+        assert "Visits 21-25 (2024-01-01 to 2024-01-05):" in prompts[3]
+        assert "Visit on" not in prompts[3]
+        # Fixed task instructions come first, ahead of any patient data
+        assert prompts[0].startswith("Summarize the visits below")
+        assert prompts[3].startswith("Please create a comprehensive patient history summary")
+
+    @pytest.mark.asyncio
+    async def test_limit_keeps_newest_visits(self, monkeypatch):
+        """A limit selects the newest visits, newest first, from unsorted input."""
+        from types import SimpleNamespace
+        from app.agents.summarizer_fallback import VisitSummarizerAgent
+
+        agent = VisitSummarizerAgent()
+        prompts = []
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            return "summary"
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        patient = SimpleNamespace(first_name="Ada", last_name="Lovelace", id=1,
+                                  date_of_birth=date(1990, 1, 1), gender="female",
+                                  medical_history=None)
+        visits = [SimpleNamespace(visit_date=date(2024, 1, day), history_entry=f"Day {day}\n")
+                  for day in (3, 9, 1, 7, 5)]
+
+        await agent.summarize_patient_history(patient, visits, limit=2)
+
+        assert "1. Visit on 2024-01-09:\nDay 9\n\n2. Visit on 2024-01-07:\nDay 7\n" in prompts[0]
+        assert "2024-01-05" not in prompts[0]
+
+    @pytest.mark.asyncio
+    async def test_oversized_chunk_summaries_compressed_once(self, monkeypatch):
+        """Chunk summaries over the token budget are rewritten before the final call."""
+        from types import SimpleNamespace
+        from app.agents import summarizer_fallback
+        from app.agents.summarizer_fallback import VisitSummarizerAgent
+
+        agent = VisitSummarizerAgent()
+        prompts = []
+        long_summary = "x" * (summarizer_fallback._HISTORY_SUMMARY_TOKEN_BUDGET
+                              * summarizer_fallback._CHARS_PER_TOKEN)
+
+        async def fake_run(prompt, **kwargs):
+            prompts.append(prompt)
+            if prompt.startswith("Summarize the visits below"):
+                return long_summary
+            if prompt.startswith("Rewrite the visit history summaries"):
+                return "compressed"
+            return "final"
+
+        monkeypatch.setattr(agent.agent, "run_async", fake_run)
+        patient = SimpleNamespace(first_name="Ada", last_name="Lovelace", id=1,
+                                  date_of_birth=date(1990, 1, 1), gender="female",
+                                  medical_history=None)
+        visits = [SimpleNamespace(visit_date=date(2024, 1, day), history_entry=f"Day {day}\n")
+                  for day in range(1, 26)]
+
+        assert await agent.summarize_patient_history(patient, visits) == "final"
+        assert len(prompts) == 5
+        assert "at most 800 tokens" in prompts[3]
+        assert prompts[4].endswith("Visit History Summary (Most Recent First):\n\ncompressed\n")
+
+    def test_history_entry_compacts_free_text(self):
+        """Blank lines and indentation in notes are not sent to the model."""
+        visit = VisitResponse.model_construct(
+            visit_type="routine", chief_complaint="Cough", diagnosis="URI",
+            treatment_plan="Rest\n\n  fluids", doctor_notes="  Line one.\n\n\n    Line two.  ")
+
+        assert visit.history_entry.endswith(
+            "   Treatment: Rest fluids\n   Notes: Line one. Line two.\n")
+
+
+class TestSummaryPrecompute:
+    """Test background visit summary precompute."""
+
+    @pytest.mark.asyncio
+    async def test_precompute_sends_summarize_prompt_and_swallows_errors(self, monkeypatch):
+        """The warmed prompt matches /summarize's; provider errors don't escape."""
+        from types import SimpleNamespace
+        from app.agents.summarizer_fallback import VisitSummarizerAgent
+
+        agent = VisitSummarizerAgent()
+        prompts = []
+
+        async def failing_run(prompt, **kwargs):
+            prompts.append(prompt)
+            raise Exception("All AI providers failed")
+
+        monkeypatch.setattr(agent.agent, "run_async", failing_run)
+        visit = SimpleNamespace(id=7, visit_date=date(2024, 3, 1), visit_type="routine",
+                                chief_complaint="Cough", diagnosis="URI",
+                                treatment_plan=None, doctor_notes=None)
+
+        await agent.precompute_summary(visit)
+        with pytest.raises(Exception):
+            await agent.summarize_visit(visit)
+
+        assert len(prompts) == 2
+        assert prompts[0] == prompts[1]
+
+
+class TestSummarizationError:
+    """Test summarizer failure reporting."""
+
+    @pytest.mark.asyncio
+    async def test_provider_failure_raises_chained_summarization_error(self, monkeypatch):
+        """The original error is kept as the cause."""
+        from types import SimpleNamespace
+        from app.agents.summarizer_fallback import SummarizationError, VisitSummarizerAgent
+
+        agent = VisitSummarizerAgent()
+        cause = Exception("All AI providers failed")
+
+        async def failing_run(prompt, **kwargs):
+            raise cause
+
+        monkeypatch.setattr(agent.agent, "run_async", failing_run)
+        visit = SimpleNamespace(id=7, visit_date=date(2024, 3, 1), visit_type="routine",
+                                chief_complaint="Cough", diagnosis="URI",
+                                treatment_plan=None, doctor_notes=None)
+
+        with pytest.raises(SummarizationError) as excinfo:
+            await agent.summarize_visit(visit)
+
+        assert excinfo.value.__cause__ is cause
+        assert str(excinfo.value) == "Visit summarization failed: All AI providers failed"
+
 
 class TestMedicalSummarizationScenarios:
     """Test various medical scenarios for visit summarization."""